@@ -3,8 +3,11 @@ from __future__ import annotations
 import sublime
 
 from .manager  import RainbowBracketsViewManager
+from .manager  import RainbowBracketsTextListener
 from .commands import RbToggleDebugCommand
 from .commands import RbClearColorSchemesCommand
+from .commands import RbMemoryReportCommand
+from .commands import RbProfileCommand
 from .commands import RbColorCommand
 from .commands import RbSweepCommand
 from .commands import RbSetupCommand
@@ -18,9 +21,12 @@ __all__ = (
     'plugin_unloaded',
     # ST: listeners
     'RainbowBracketsViewManager',
+    'RainbowBracketsTextListener',
     # ST: commands
     'RbToggleDebugCommand',
     'RbClearColorSchemesCommand',
+    'RbMemoryReportCommand',
+    'RbProfileCommand',
     'RbEditBracketsCommand',
     'RbColorCommand',
     'RbSweepCommand',
@@ -1,9 +1,7 @@
-import json
+import threading
 import weakref
 
-from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
-from pathlib import PurePath, Path
 
 import sublime
 
@@ -38,12 +36,38 @@ def _nearest_color(color: str):
 # scope color pairs
 PlainRules = List[Tuple[str, str]]
 
+# Records the fingerprint of every generated color scheme by file name,
+# kept next to them in the cache directory
+MANIFEST_FILE = 'manifest.json'
+
+
+def cs_file_name(color_scheme: str) -> str:
+    """
+    The name of the file generated for `color_scheme`.
+    """
+    from pathlib import PurePath
+    return PurePath(color_scheme).with_suffix('.sublime-color-scheme').name
+
 
 class ColorSchemeManager:
     plain_rules: Dict[str, PlainRules] = {}
 
     view_current_cs: Dict[sublime.View, Optional[str]] = {}
 
+    # The number of attached views using each generated file
+    cs_refcounts: Dict[str, int] = {}
+
+    # The generated texts by colors, background and rules index
+    cs_texts: Dict[Tuple[Tuple[str, ...], str, str], str] = {}
+
+    # Bytes of unused generated files to keep, the most recently
+    # written ones are kept
+    cache_size_cap = 256 * 1024
+
+    # Serializes the accesses to the generated files and the manifest
+    cache_lock = threading.Lock()
+    gc_pending = False
+
     def __new__(cls, *args, **kwargs):
         if hasattr(cls, 'objref'):
             if obj := cls.objref():
@@ -54,27 +78,56 @@ class ColorSchemeManager:
 
     def set_colors(self, scope_color_pairs: PlainRules):
         index = str(scope_color_pairs)
+        if index == getattr(self, 'current_rules_index', None):
+            return
         self.last_written_cs = None
+        # The texts generated from the previous rules are stale
+        self.plain_rules.clear()
         self.plain_rules[index] = scope_color_pairs
+        self.cs_texts.clear()
         self.current_rules_index = index
 
         for view in self.view_current_cs:
             self.rewrite_view_cs(view)
 
     def attach_view(self, view: sublime.View):
+        if view in self.view_current_cs:
+            return
         self.view_current_cs[view] = None
         def on_change():
             view_new_cs = settings.get('color_scheme', DEFAULT_CS)
-            if view_new_cs != self.view_current_cs[view]:
+            view_old_cs = self.view_current_cs[view]
+            if view_new_cs != view_old_cs:
                 self.view_current_cs[view] = view_new_cs
+                self.incref(view_new_cs)
+                if view_old_cs is not None:
+                    self.decref(view_old_cs)
                 if view_new_cs != self.last_written_cs:
                     self.rewrite_view_cs(view)
         settings = view.settings()
         settings.add_on_change('rb.color_scheme_mgr', on_change)
+        on_change()
 
     def detach_view(self, view: sublime.View):
         view.settings().clear_on_change('rb.color_scheme_mgr')
-        self.view_current_cs.pop(view, None)
+        cs = self.view_current_cs.pop(view, None)
+        if cs is not None:
+            self.decref(cs)
+
+    def incref(self, color_scheme: str):
+        name = cs_file_name(color_scheme)
+        self.cs_refcounts[name] = self.cs_refcounts.get(name, 0) + 1
+
+    def decref(self, color_scheme: str):
+        name = cs_file_name(color_scheme)
+        count = self.cs_refcounts.get(name, 0) - 1
+        if count > 0:
+            self.cs_refcounts[name] = count
+        else:
+            self.cs_refcounts.pop(name, None)
+            if not self.gc_pending:
+                self.gc_pending = True
+                sublime.set_timeout_async(self.collect_color_schemes, 1000)
 
     def rewrite_view_cs(self, view: sublime.View):
         cs = self.view_current_cs[view]
@@ -100,35 +153,73 @@ class ColorSchemeManager:
         used at the same time.
         """
         style = view.style()
-        cs_text = self.generate_cs_text(
-            tuple(style[k] for k in builtin_color_names),
-            style['background'],
-            self.current_rules_index
-        )
-        cs_path = PurePath(color_scheme)
-        cache_path = self.cache_path()
-        cache_path.mkdir(parents=True, exist_ok=True)
-        cache_path.joinpath(
-            cs_path.with_suffix('.sublime-color-scheme').name
-            ).write_text(cs_text)
-        Logger.print(f'Write color scheme {cs_path.stem}')
+        colors = tuple(style[k] for k in builtin_color_names)
+        background = style['background']
+        cs_name = cs_file_name(color_scheme)
+        cs_file = self.cache_path().joinpath(cs_name)
+        fingerprint = self.cs_fingerprint(
+            colors, background, self.current_rules_index)
+        with self.cache_lock:
+            manifest = self.load_manifest()
+            if manifest.get(cs_name) == fingerprint and cs_file.exists():
+                Logger.print(f'Reuse color scheme {cs_file.stem}')
+                return
+            cs_text = self.generate_cs_text(
+                colors, background, self.current_rules_index)
+            cs_file.parent.mkdir(parents=True, exist_ok=True)
+            cs_file.write_text(cs_text)
+            manifest[cs_name] = fingerprint
+            self.save_manifest()
+        Logger.print(f'Write color scheme {cs_file.stem}')
 
     def cache_path(self):
         try:
             return self._cache_path
         except:
+            from pathlib import Path
             self._cache_path = Path(
                 sublime.packages_path(), 'User', 'Color Schemes', PACKAGE_NAME)
             return self._cache_path
 
-    @lru_cache
+    @staticmethod
+    def cs_fingerprint(colors: Tuple[str], bg: str, rules_index: str) -> str:
+        import hashlib
+        key = repr((colors, bg, rules_index)).encode()
+        return hashlib.sha1(key).hexdigest()
+
+    def load_manifest(self) -> Dict[str, str]:
+        try:
+            return self._manifest
+        except:
+            import json
+            try:
+                text = self.cache_path().joinpath(MANIFEST_FILE).read_text()
+                self._manifest = json.loads(text)
+            except (OSError, ValueError):
+                self._manifest = {}
+            return self._manifest
+
+    def save_manifest(self):
+        import json
+        manifest_file = self.cache_path().joinpath(MANIFEST_FILE)
+        try:
+            manifest_file.write_text(json.dumps(self.load_manifest()))
+        except OSError:
+            pass
+
     def generate_cs_text(self,
         colors: Tuple[str], bg: str, rules_index: str) -> str:
         """
         Generate the color scheme text from the given colors,
-        background color and rules index, use lru_cache to
-        cache the results.
+        background color and rules index, the results are cached
+        in `cs_texts` until the rules change.
         """
+        key = (colors, bg, rules_index)
+        if key in self.cs_texts:
+            return self.cs_texts[key]
+
+        import json
+
         rules = []
         variables = {}
         nearest_bg = _nearest_color(bg)
@@ -149,32 +240,58 @@ class ColorSchemeManager:
                 "background": background
             })
 
-        return json.dumps(
+        cs_text = self.cs_texts[key] = json.dumps(
             {
                 "author": PACKAGE_URL,
                 "variables": variables,
                 "rules": rules
             }
         )
+        return cs_text
 
-    def get_all_inuse_color_schemes(self):
-        color_scheme_set = set()
-        for window in sublime.windows():
-            for view in window.views(include_transient=True):
-                color_scheme = view.settings().get('color_scheme')
-                color_scheme_set.add(PurePath(color_scheme).stem)
-        return color_scheme_set
-
-    def clear_color_schemes(self):
+    def collect_color_schemes(self, cap: Optional[int] = None):
+        """
+        Remove the generated files that no attached view uses, except
+        the most recently written ones within `cap` bytes, which
+        defaults to `cache_size_cap`.
+        """
+        self.gc_pending = False
+        if cap is None:
+            cap = self.cache_size_cap
         cache_path = self.cache_path()
-        inuse_color_schemes = self.get_all_inuse_color_schemes()
-        for file in cache_path.iterdir():
-            if file.stem not in inuse_color_schemes:
+        if not cache_path.is_dir():
+            return
+        with self.cache_lock:
+            unused_files = []
+            for file in cache_path.iterdir():
+                if file.name == MANIFEST_FILE:
+                    continue
+                if file.name not in self.cs_refcounts:
+                    try:
+                        stat = file.stat()
+                    except OSError:
+                        continue
+                    unused_files.append((stat.st_mtime, stat.st_size, file))
+            unused_files.sort(key=lambda f: f[0], reverse=True)
+            manifest = self.load_manifest()
+            last_written_cs = getattr(self, 'last_written_cs', None)
+            kept_size = 0
+            for _, size, file in unused_files:
+                kept_size += size
+                if kept_size <= cap:
+                    continue
                 try:
                     file.unlink()
+                    manifest.pop(file.name, None)
+                    if (last_written_cs is not None and
+                        cs_file_name(last_written_cs) == file.name):
+                        self.last_written_cs = None
                     Logger.print('Removed', file.name)
-                except:
+                except OSError:
                     pass
+            self.save_manifest()
 
+    def clear_color_schemes(self):
+        self.collect_color_schemes(cap=0)
 
 cs_mgr = ColorSchemeManager()
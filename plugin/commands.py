@@ -3,13 +3,18 @@ import time
 import sublime
 import sublime_plugin
 
-from typing import Iterable, List, Optional, Pattern, Tuple
+from typing import Iterable, List, Optional, Set
 
+from .consts  import PACKAGE_NAME
 from .consts  import SETTINGS_FILE
 from .logger  import Logger
 from .manager import RainbowBracketsViewManager as _manager
-from .executor import BracketTree
+from .engine import BracketTree
+from .engine import find_bracket_path
 from .color_scheme import cs_mgr
+from .memory import format_size
+from .profiler import Profiler
+from .profiler import profiled
 
 
 class RbToggleDebugCommand(sublime_plugin.ApplicationCommand):
@@ -24,6 +29,27 @@ class RbClearColorSchemesCommand(sublime_plugin.ApplicationCommand):
         cs_mgr.clear_color_schemes()
 
 
+class RbMemoryReportCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        usages = _manager.memory_usages()
+        total = sum(u.total for u in usages)
+        lines = [f'Total: {format_size(total)}']
+        if _manager.memory_ceiling:
+            lines.append(f'Ceiling: {format_size(_manager.memory_ceiling)}')
+        lines.extend(u.format() for u in usages)
+        panel = self.window.create_output_panel('rb_memory_report')
+        panel.run_command('append', {'characters': '\n\n'.join(lines)})
+        self.window.run_command('show_panel', {'panel': 'output.rb_memory_report'})
+        _manager.check_memory_ceiling()
+
+
+class RbProfileCommand(sublime_plugin.ApplicationCommand):
+    def run(self, calls=5, top=30):
+        Profiler.arm(calls, top)
+        sublime.status_message(
+            f'{PACKAGE_NAME}: profiling the next {calls} parses and edits')
+
+
 class RbViewCommand(sublime_plugin.TextCommand):
     def get_executor(self):
         return _manager.get_view_executor(self.view)
@@ -76,29 +102,38 @@ class RbEditBracketsCommand(sublime_plugin.TextCommand):
             'transform': self.transform,
         }
 
+    @profiled
     def run(self, edit, operation='', **args):
         trees = _manager.get_view_bracket_trees(self.view)
         if trees:
             self.operators[operation](edit, trees, **args)
 
     def remove(self, edit, bracket_trees, select_content):
-        pairs = [p for p in self._find_cursor_brackets(bracket_trees)]
-        regions = [r for p in pairs for r in p]
+        _Region = sublime.Region
+        nodes = [p for p in self._find_cursor_brackets(bracket_trees)]
+        regions = [r for p in nodes for r in ((p.oa, p.ob), (p.ca, p.cb))]
         regions.sort()
-        for r in reversed(regions):
-            self.view.erase(edit, r)
+        for a, b in reversed(regions):
+            self.view.erase(edit, _Region(a, b))
         if select_content:
             selections = []
-            _Region = sublime.Region
-            for p in pairs:
-                begin = p[0].a - regions.index(p[0])
-                end = p[1].a - regions.index(p[1])
-                selections.append(_Region(begin, end))
+            # Offset of each removed bracket, shifted by the total size
+            # of the brackets removed before it
+            shifted = {}
+            removed = 0
+            for a, b in regions:
+                shifted[a] = a - removed
+                removed += b - a
+            for p in nodes:
+                selections.append(_Region(shifted[p.oa], shifted[p.ca]))
             self.view.sel().add_all(selections)
 
     def select(self, edit, bracket_trees, to=''):
-        regex = to and re.compile(to + r'\b') or None
-        for p in self._find_cursor_brackets(bracket_trees, regex=regex):
+        heads = None
+        if to:
+            executor = _manager.get_view_executor(self.view)
+            heads = executor.match_heads(re.compile(to + r'\b'))  # type: ignore
+        for p in self._find_cursor_brackets(bracket_trees, heads=heads):
             region = self._cover(p)
             self.view.sel().add(region)
 
@@ -116,17 +151,19 @@ class RbEditBracketsCommand(sublime_plugin.TextCommand):
         self.last_tobe = left
         right = brackets[left]
 
+        _Region = sublime.Region
         points = self.view.sel()
         while True:
             replacements = []
             outer_points = []
             found = False
             for p in self._find_cursor_brackets(bracket_trees, cursors=points):
-                outer_points.append(p[0])
-                if self.view.substr(p[0]) == left:
+                opening = _Region(p.oa, p.ob)
+                outer_points.append(opening)
+                if self.view.substr(opening) == left:
                     continue
-                replacements.append((p[0], left))
-                replacements.append((p[1], right))
+                replacements.append((opening, left))
+                replacements.append((_Region(p.ca, p.cb), right))
                 found = True
             if not look_farther or found:
                 break
@@ -138,20 +175,20 @@ class RbEditBracketsCommand(sublime_plugin.TextCommand):
         for region, content in replacements:
             self.view.replace(edit, region, content)
 
-    def _cover(self, bracket_pair, _Region=sublime.Region):
-        return _Region(bracket_pair[0].a, bracket_pair[1].b)
+    def _cover(self, node: BracketTree, _Region=sublime.Region):
+        return _Region(node.oa, node.cb)
 
     def _find_cursor_brackets(
         self,
         trees: List[BracketTree],
         cursors: Optional[Iterable[sublime.Region]] = None,
-        regex: Optional[Pattern[str]] = None
+        heads: Optional[Set[int]] = None
     ):
         last_bracket = None
         if cursors is None:
             cursors = self.view.sel()
         for region in cursors:
-            bracket = self._find_nearest(trees, region, regex)
+            bracket = self._find_nearest(trees, region, heads)
             if bracket is None or bracket == last_bracket:
                 continue
             else:
@@ -162,16 +199,13 @@ class RbEditBracketsCommand(sublime_plugin.TextCommand):
         self,
         trees: List[BracketTree],
         region: sublime.Region,
-        regex: Optional[Pattern[str]],
-        _Region=sublime.Region
+        heads: Optional[Set[int]]
     ):
-        pairs = self._binary_path_search(trees, region.begin(), region.end())
+        pairs = find_bracket_path(trees, region.begin(), region.end())
         bracket = None
-        if pairs and regex is not None:
+        if pairs and heads is not None:
             for p in reversed(pairs):
-                point = p[0].end()
-                text = self.view.substr(_Region(point, point + 31))
-                if regex.match(text) is not None:
+                if p.head in heads:
                     bracket = p
                     break
             else:
@@ -181,39 +215,7 @@ class RbEditBracketsCommand(sublime_plugin.TextCommand):
 
         if bracket is None and region.empty():
             for tree in trees:
-                if (tree.opening.a == region.a or
-                    tree.closing.b == region.a):
-                    bracket = (tree.opening, tree.closing)
+                if tree.oa == region.a or tree.cb == region.a:
+                    bracket = tree
                     break
         return bracket
-
-    def _binary_path_search(
-        self,
-        trees: List[BracketTree],
-        r_begin: int,
-        r_end: int
-    ):
-        bracket_path: List[Tuple[sublime.Region, sublime.Region]] = []
-        while True:
-            found_closer = False
-            lo, hi = 0, len(trees) - 1
-            while lo <= hi:
-                mi = (lo + hi) >> 1
-                tr = trees[mi]
-                oa = tr.opening.a
-                cb = tr.closing.b
-                if cb < r_begin:
-                    lo = mi + 1
-                elif oa > r_end:
-                    hi = mi - 1
-                else:
-                    if (oa < r_begin and r_end < cb or
-                        r_begin == r_end and (r_end == oa or r_begin == cb)):
-                        found_closer = True
-                        trees = tr.contain
-                        p = (tr.opening, tr.closing)
-                        bracket_path.append(p)
-                    break
-            if not found_closer:
-                break
-        return bracket_path
@@ -0,0 +1,430 @@
+# The bracket parsing shared by the plugin and the command line linter,
+# it must not depend on the `sublime` module.
+import re
+
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Pattern, Set
+
+
+# Flat buffer of `begin, end` offset pairs.
+Offsets = array
+
+# The symbols of the identifier right after an opening bracket, such
+# as `define` or `set-car!`, besides word characters.
+HEAD_SYMBOLS = '!$%&*+-./:<=>?@^~'
+HEAD_TOKEN_MAXLEN = 31
+
+
+class BracketTree:
+    """
+    A matched bracket pair, `oa:ob` is the opening bracket and
+    `ca:cb` the closing bracket, as plain text offsets. `head` is
+    the ID of the token following the opening bracket.
+    """
+    __slots__ = ['oa', 'ob', 'ca', 'cb', 'head', 'contain']
+
+    def __init__(
+        self,
+        oa: int,
+        ob: int,
+        ca: int,
+        cb: int,
+        head: int,
+        contain: List['BracketTree']
+    ):
+        self.oa = oa
+        self.ob = ob
+        self.ca = ca
+        self.cb = cb
+        self.head = head
+        self.contain = contain
+
+
+def find_bracket_path(
+    trees: List[BracketTree],
+    r_begin: int,
+    r_end: int
+) -> List[BracketTree]:
+    """
+    The trees enclosing the region `r_begin:r_end`, outermost first.
+    An empty region touching the outside of a bracket pair counts as
+    enclosed by it.
+    """
+    bracket_path: List[BracketTree] = []
+    while True:
+        found_closer = False
+        lo, hi = 0, len(trees) - 1
+        while lo <= hi:
+            mi = (lo + hi) >> 1
+            tr = trees[mi]
+            oa = tr.oa
+            cb = tr.cb
+            if cb < r_begin:
+                lo = mi + 1
+            elif oa > r_end:
+                hi = mi - 1
+            else:
+                if (oa < r_begin and r_end < cb or
+                    r_begin == r_end and (r_end == oa or r_begin == cb)):
+                    found_closer = True
+                    trees = tr.contain
+                    bracket_path.append(tr)
+                break
+        if not found_closer:
+            break
+    return bracket_path
+
+
+def head_pattern(brackets: List[str]) -> str:
+    """
+    The pattern of a head token, which stops at any of the `brackets`,
+    so that `<` and `>` are not taken into `a<b>` when they are brackets.
+    """
+    symbols = ''.join(c for c in HEAD_SYMBOLS if c not in brackets)
+    char = f'[\\w{re.escape(symbols)}]'
+    # The brackets a character class can't leave out
+    others = [b for b in brackets if len(b) > 1 or re.match(r'\w', b)]
+    if others:
+        lookahead = '|'.join(map(re.escape, others))
+        char = f'(?:(?!{lookahead}){char})'
+    return char + '+'
+
+
+def compile_config(
+    config: Dict[str, Any],
+    syntax: Optional[str],
+    is_default: bool,
+    scope_color_map: Dict[str, str]
+):
+    color_cycle = config.get('color.cycle', [])
+    color_error = config.get('color.error')
+    color_active = config.get('color.active')
+    if color_cycle:
+        scopes = config['scopes'] = []
+        keys = config['keys'] = []
+        for i, color in enumerate(color_cycle):
+            if is_default:
+                key   = f'_rb_l{i}'
+                scope = f'l{i}._rb'
+            else:
+                key   = f'_rb_l{i}_{syntax}'
+                scope = f'{syntax}.l{i}._rb'
+            keys.append(key)
+            scopes.append(scope)
+            scope_color_map[scope] = color
+        config['keys']   = keys
+        config['scopes'] = scopes
+    if color_error is not None:
+        if is_default:
+            key   = f'_rb_error'
+            scope = f'error._rb'
+        else:
+            key   = f'_rb_error_{syntax}'
+            scope = f'{syntax}.error._rb'
+        config['err_key']   = key
+        config['err_scope'] = scope
+        scope_color_map[scope] = color_error
+    if color_active is not None:
+        if is_default:
+            key   = f'_rb_active'
+            scope = f'active._rb'
+        else:
+            key   = f'_rb_active_{syntax}'
+            scope = f'{syntax}.active._rb'
+        config['active_key']   = key
+        config['active_scope'] = scope
+        scope_color_map[scope] = color_active
+    if 'bracket_pairs' in config:
+        pairs = config['bracket_pairs']
+        brackets = sorted(set(pairs.keys()) | set(pairs.values()))
+        # Each bracket is captured by its own group, so that the index
+        # of the matched group (`m.lastindex`) identifies the bracket.
+        config['tokens']   = brackets
+        config['pattern']  = '|'.join(f'({re.escape(b)})' for b in brackets)
+        config['head_pattern'] = head_pattern(brackets)
+    if 'ignored_scopes' in config:
+        config['selector'] = '|'.join(config['ignored_scopes'])
+
+
+class BracketMatcher():
+    """
+    Parse the brackets of the text returned by `read_text`. Brackets
+    at points accepted by `scope_matcher()(point, selector)` are
+    ignored.
+    """
+    # Whether to read the head tokens, only the editing commands use them
+    collect_heads = True
+
+    def __init__(self, config: Dict[str, Any]):
+        self.selector  = config['selector']       # type: str
+        self.brackets  = config['bracket_pairs']  # type: Dict[str, str]
+        self.pattern   = config['pattern']        # type: str
+        self.tokens    = config['tokens']         # type: List[str]
+        self.color_number = len(config['keys'])
+        # Token IDs are the group indices of `pattern`, starting at 1.
+        # `closers[t]` is the ID of the closing bracket of the opening
+        # bracket `t`, or 0 if `t` is not an opening bracket.
+        token_ids = {b: i for i, b in enumerate(self.tokens, 1)}
+        self.closers = [0] * (len(self.tokens) + 1)
+        for opening, closing in self.brackets.items():
+            self.closers[token_ids[opening]] = token_ids[closing]
+        self.err_bracket_regions: Offsets = array('q')
+        self.unclosed_bracket_regions: Offsets = array('q')
+        self.bracket_regions_lists: List[Offsets] = []
+        self.bracket_regions_trees: List[BracketTree] = []
+        # The opening brackets left unclosed, outermost first, with the
+        # pairs they contain, which are not part of the trees
+        self.unclosed_trees: List[BracketTree] = []
+        # The number of matched pairs, with the ones in unclosed brackets
+        self.pair_count = 0
+        self.regexp = re.compile(self.pattern)
+        self.head_token = re.compile(config['head_pattern'])
+        self.max_token_len = max(map(len, self.tokens))
+        # The text the brackets were parsed from
+        self.text: Optional[str] = None
+        # Interned head tokens, `head_names[node.head]` is the token
+        # following the opening bracket of `node`, 0 is no token.
+        self.head_names: List[str] = ['']
+        self.head_ids: Dict[str, int] = {'': 0}
+        # The number of head tokens after the last scan or compaction
+        self.live_heads = 1
+
+    def read_text(self) -> str:
+        raise NotImplementedError
+
+    def scope_matcher(self) -> Optional[Callable[[int, str], bool]]:
+        return None
+
+    def match_heads(self, regex: Pattern[str]) -> Set[int]:
+        """
+        The IDs of the head tokens matched by `regex`.
+        """
+        return {i for i, name in enumerate(self.head_names) if regex.match(name)}
+
+    def _head_at(self, text: str, point: int) -> int:
+        m = self.head_token.match(text, point, point + HEAD_TOKEN_MAXLEN)
+        if m is None:
+            return 0
+        return self._intern_head(m.group())
+
+    def _intern_head(self, name: str) -> int:
+        head = self.head_ids.get(name)
+        if head is None:
+            head = self.head_ids[name] = len(self.head_names)
+            self.head_names.append(name)
+        return head
+
+    def _reset_heads(self):
+        self.head_names = ['']
+        self.head_ids = {'': 0}
+
+    def compact_heads(self):
+        """
+        Drop the head tokens no bracket refers to anymore, such as the
+        ones replaced while the head of a bracket is typed.
+        """
+        names = self.head_names
+        self._reset_heads()
+        intern_head = self._intern_head
+        stack = self.bracket_regions_trees + self.unclosed_trees
+        while stack:
+            node = stack.pop()
+            if node.head:
+                node.head = intern_head(names[node.head])
+            stack.extend(node.contain)
+        self.live_heads = len(self.head_names)
+
+    def unclosed_tree_at(self, point: int) -> Optional[BracketTree]:
+        """
+        The innermost unclosed bracket opened before `point`, what
+        follows the opening of an unclosed bracket is in it.
+        """
+        unclosed = self.unclosed_trees
+        lo, hi = 0, len(unclosed)
+        while lo < hi:
+            mi = (lo + hi) >> 1
+            if unclosed[mi].ob <= point:
+                lo = mi + 1
+            else:
+                hi = mi
+        return unclosed[lo - 1] if lo else None
+
+    def find_pair_path(self, begin: int, end: int) -> List[BracketTree]:
+        """
+        The bracket pairs enclosing the region `begin:end`, outermost
+        first, within the innermost unclosed bracket opened before it.
+        """
+        node = self.unclosed_tree_at(begin)
+        trees = node.contain if node else self.bracket_regions_trees
+        return find_bracket_path(trees, begin, end)
+
+    def _innermost_tree(self, point: int) -> Optional[BracketTree]:
+        """
+        The innermost tree whose brackets enclose `point`, which may be
+        an unclosed bracket.
+        """
+        node = self.unclosed_tree_at(point)
+        trees = node.contain if node else self.bracket_regions_trees
+        while trees:
+            lo, hi = 0, len(trees)
+            while lo < hi:
+                mi = (lo + hi) >> 1
+                if trees[mi].ca < point:
+                    lo = mi + 1
+                else:
+                    hi = mi
+            if lo == len(trees) or trees[lo].ob > point:
+                break
+            node = trees[lo]
+            trees = node.contain
+        return node
+
+    def construct_bracket_trees(self):
+        self.bracket_regions_trees = []
+        self._reset_heads()
+
+        opening_stack   = []
+        tree_node_stack = [BracketTree(0, 0, 0, 0, 0, self.bracket_regions_trees)]
+        pair_count      = [0]
+
+        def handle_bracket(
+            token, begin, end,
+            Node=BracketTree,
+            closers=self.closers,
+            head_at=self._head_at if self.collect_heads else None,
+            opening_stack=opening_stack,
+            opening_stack_append=opening_stack.append,
+            opening_stack_pop=opening_stack.pop,
+            tree_node_stack=tree_node_stack,
+            tree_node_stack_append=tree_node_stack.append,
+            tree_node_stack_pop=tree_node_stack.pop,
+            pair_count=pair_count
+        ):
+            closer = closers[token]
+            if closer:
+                head = head_at(self.text, end) if head_at else 0
+                tree_node_stack_append(Node(begin, end, 0, 0, head, []))
+                opening_stack_append(closer)
+
+            elif opening_stack and token == opening_stack[-1]:
+                opening_stack_pop()
+                node = tree_node_stack_pop()
+                node.ca = begin
+                node.cb = end
+                tree_node_stack[-1].contain.append(node)
+                pair_count[0] += 1
+
+        self._iterate_brackets(handle_bracket)
+        self.unclosed_trees = tree_node_stack[1:]
+        self.pair_count = pair_count[0]
+        self.live_heads = len(self.head_names)
+
+    def construct_bracket_lists(self):
+        """
+        Redistribute the brackets of the trees, and of the pairs in the
+        unclosed brackets, over the layers without scanning the text
+        again. As in the scan, the pairs of a layer are in the order
+        they are closed.
+        """
+        num_layers = self.color_number
+        offsets_by_layer = [array('q') for _ in range(num_layers)]
+        # The pairs in the `i`-th unclosed bracket, counting from 1, are
+        # at depth `i`, and close after the pairs before that bracket
+        forests = [(self.bracket_regions_trees, 0)]
+        forests.extend(
+            (node.contain, depth)
+            for depth, node in enumerate(self.unclosed_trees, 1)
+        )
+        for trees, depth in forests:
+            # A node is pushed again as `~depth` (a negative number)
+            # to be emitted after its children, which close before it
+            stack = [(node, depth) for node in reversed(trees)]
+            while stack:
+                node, depth = stack.pop()
+                if depth < 0:
+                    append = offsets_by_layer[~depth % num_layers].append
+                    append(node.oa)
+                    append(node.ob)
+                    append(node.ca)
+                    append(node.cb)
+                    continue
+                stack.append((node, ~depth))
+                stack.extend((child, depth + 1) for child in reversed(node.contain))
+        self.bracket_regions_lists = [ls for ls in offsets_by_layer if ls]
+
+    def construct_bracket_trees_and_lists(self):
+        """
+        Besides the trees, collect the matched brackets by layer and the
+        unmatched closing brackets. The opening brackets left unclosed
+        at the end of the text are kept in `unclosed_trees`.
+        """
+        self.err_bracket_regions   = array('q')
+        self.bracket_regions_lists = []
+        self.bracket_regions_trees = []
+        self._reset_heads()
+
+        opening_stack    = []
+        tree_node_stack  = [BracketTree(0, 0, 0, 0, 0, self.bracket_regions_trees)]
+        offsets_by_layer = [array('q') for _ in range(self.color_number)]
+
+        def handle_bracket(
+            token, begin, end,
+            Node=BracketTree,
+            closers=self.closers,
+            head_at=self._head_at if self.collect_heads else None,
+            num_layers=self.color_number,
+            opening_stack=opening_stack,
+            opening_stack_append=opening_stack.append,
+            opening_stack_pop=opening_stack.pop,
+            tree_node_stack=tree_node_stack,
+            tree_node_stack_append=tree_node_stack.append,
+            tree_node_stack_pop=tree_node_stack.pop,
+            appends=[offsets.append for offsets in offsets_by_layer],
+            err_append=self.err_bracket_regions.append
+        ):
+            closer = closers[token]
+            if closer:
+                head = head_at(self.text, end) if head_at else 0
+                tree_node_stack_append(Node(begin, end, 0, 0, head, []))
+                opening_stack_append(closer)
+
+            elif opening_stack and token == opening_stack[-1]:
+                opening_stack_pop()
+                node = tree_node_stack_pop()
+                node.ca = begin
+                node.cb = end
+                tree_node_stack[-1].contain.append(node)
+                append = appends[len(opening_stack) % num_layers]
+                append(node.oa)
+                append(node.ob)
+                append(begin)
+                append(end)
+            else:
+                err_append(begin)
+                err_append(end)
+
+        self._iterate_brackets(handle_bracket)
+        self.bracket_regions_lists = [ls for ls in offsets_by_layer if ls]
+        self.unclosed_trees = tree_node_stack[1:]
+        self.pair_count = sum(map(len, self.bracket_regions_lists)) >> 2
+        self.live_heads = len(self.head_names)
+        self.unclosed_bracket_regions = array('q')
+        for node in self.unclosed_trees:
+            self.unclosed_bracket_regions.append(node.oa)
+            self.unclosed_bracket_regions.append(node.ob)
+
+    def _iterate_brackets(self, handle: Callable[[int, int, int], None]):
+        full_text = self.read_text()
+        self.text = full_text
+        matches = self.regexp.finditer(full_text)
+        ignore = self.scope_matcher()
+        ignored_scope_selector = self.selector
+        if ignore and ignored_scope_selector:
+            for m in matches:
+                begin = m.start()
+                if ignore(begin, ignored_scope_selector):
+                    continue
+                handle(m.lastindex, begin, m.end())
+        else:
+            for m in matches:
+                handle(m.lastindex, m.start(), m.end())
@@ -3,44 +3,82 @@ import os
 import time
 import sublime
 
-from typing import Callable, Dict, List, Optional, TypedDict
-from typing_extensions import Self
+from bisect import bisect_right
+from typing import Callable, List, Optional, Sequence, Tuple
 
+from .engine import BracketMatcher, BracketTree, Offsets
 from .logger import Logger
+from .profiler import profiled
 
 
-class BracketTree:
-    __slots__ = ['opening', 'closing', 'contain']
+# Text that can be typed or deleted without changing the brackets,
+# provided that it does not form a bracket with its neighbours.
+PLAIN_TEXT = re.compile(r'[\w \t]*')
 
+# Milliseconds to wait before highlighting the active bracket pairs,
+# so that they are updated at most once per frame.
+ACTIVE_PAIRS_DELAY = 16
+
+# Head tokens the table may gain from edits, beyond twice the ones it
+# had after the last scan, before it is compacted.
+HEAD_TABLE_SLACK = 64
+
+
+class SnapshotMatcher(BracketMatcher):
+    """
+    Parse a snapshot of the text of a view, off the main thread.
+    """
     def __init__(
         self,
-        opening: sublime.Region,
-        closing: sublime.Region,
-        contain: List[Self]
+        config,
+        text: str,
+        match_selector: Callable[[int, str], bool]
     ):
-        self.opening = opening
-        self.closing = closing
-        self.contain = contain
+        super().__init__(config)
+        self.snapshot = text
+        self.match_selector = match_selector
+
+    def read_text(self) -> str:
+        return self.snapshot
 
+    def scope_matcher(self):
+        return self.match_selector
 
-class RainbowBracketsExecutor():
+    def scan(self, coloring: bool):
+        if coloring:
+            self.construct_bracket_trees_and_lists()
+        else:
+            self.construct_bracket_trees()
+        self.snapshot = ''
+        return self
+
+
+def to_regions(offsets: Offsets, Region=sublime.Region):
+    """
+    Materialize a flat buffer of offset pairs into regions.
+    """
+    it = iter(offsets)
+    return [Region(a, b) for a, b in zip(it, it)]
+
+
+class RainbowBracketsExecutor(BracketMatcher):
     def __init__(self, view: sublime.View, syntax: Optional[str], config):
+        super().__init__(config)
         self.err_key   = config['err_key']        # type: str
         self.err_scope = config['err_scope']      # type: str
         self.coloring  = config['coloring']       # type: bool
         self.keys      = config['keys']           # type: List[str]
         self.scopes    = config['scopes']         # type: List[str]
-        self.selector  = config['selector']       # type: str
-        self.brackets  = config['bracket_pairs']  # type: Dict[str, str]
-        self.pattern   = config['pattern']        # type: str
-        self.color_number = len(self.keys)
-        self.err_bracket_regions: List[sublime.Region] = []
-        self.bracket_regions_lists: List[List[sublime.Region]] = []
-        self.bracket_regions_trees: List[BracketTree] = []
-        self.regexp = re.compile(self.pattern)
+        self.active_key   = config.get('active_key')    # type: Optional[str]
+        self.active_scope = config.get('active_scope')  # type: Optional[str]
+        # The offsets of the highlighted bracket pairs
+        self.active_pairs: List[Tuple[int, int, int, int]] = []
+        self.active_pending = False
         self.syntax = syntax
         self.config = config
         self.view = view
+        # The matcher whose results are awaited by `adopt_snapshot`
+        self.pending_snapshot: Optional[SnapshotMatcher] = None
 
     def __del__(self):
         self.clear_bracket_regions()
@@ -49,6 +87,12 @@ class RainbowBracketsExecutor():
     def view_file_name(self):
         return os.path.basename(self.view.file_name() or 'untitled')
 
+    def read_text(self) -> str:
+        return self.view.substr(sublime.Region(0, self.view.size()))
+
+    def scope_matcher(self):
+        return self.view.match_selector
+
     def load(self):
         start = time.time()
         self.check_bracket_regions()
@@ -65,118 +109,370 @@ class RainbowBracketsExecutor():
                 ])
             )
 
+    def rekey(self, config):
+        """
+        Move the painted brackets to the region keys and scopes of
+        `config`, which must only differ from the current config in
+        them, the parsed brackets are reused.
+        """
+        self.clear_bracket_regions()
+        self.err_key   = config['err_key']
+        self.err_scope = config['err_scope']
+        self.keys      = config['keys']
+        self.scopes    = config['scopes']
+        self.active_key   = config.get('active_key')
+        self.active_scope = config.get('active_scope')
+        self.config    = config
+        if len(self.keys) != self.color_number:
+            self.color_number = len(self.keys)
+            if self.coloring:
+                self.construct_bracket_lists()
+        if self.coloring:
+            self.publish_bracket_regions()
+
+    def on_selection_modified(self):
+        if self.active_key and self.coloring and not self.active_pending:
+            self.active_pending = True
+            sublime.set_timeout(self.update_active_pairs, ACTIVE_PAIRS_DELAY)
+
+    def update_active_pairs(self):
+        """
+        Highlight the innermost bracket pair enclosing each cursor,
+        the regions are only republished when the pairs change.
+        """
+        self.active_pending = False
+        if not (self.active_key and self.coloring and self.view.is_valid()):
+            return
+        pairs = set()
+        for region in self.view.sel():
+            path = self.find_pair_path(region.begin(), region.end())
+            if path:
+                node = path[-1]
+                pairs.add((node.oa, node.ob, node.ca, node.cb))
+        active_pairs = sorted(pairs)
+        if active_pairs == self.active_pairs:
+            return
+        self.active_pairs = active_pairs
+        if not active_pairs:
+            self.view.erase_regions(self.active_key)
+            return
+        Region = sublime.Region
+        self.view.add_regions(
+            self.active_key,
+            [r for oa, ob, ca, cb in active_pairs
+               for r in (Region(oa, ob), Region(ca, cb))],
+            scope=self.active_scope,  # type: ignore
+            flags=sublime.DRAW_NO_FILL
+        )
+
+    def clear_active_pairs(self):
+        if self.active_key:
+            self.view.erase_regions(self.active_key)
+        self.active_pairs = []
+
+    def take_snapshot(self) -> Tuple[SnapshotMatcher, int]:
+        """
+        A matcher of the current text to be scanned on another thread,
+        and the change count of the view at this time.
+        """
+        matcher = SnapshotMatcher(
+            self.config, self.read_text(), self.view.match_selector)
+        self.pending_snapshot = matcher
+        return matcher, self.view.change_count()
+
+    def adopt_snapshot(self, matcher: SnapshotMatcher, change_count: int):
+        """
+        Take over the results of a scanned snapshot, unless they have
+        been superseded. If the text changed since the snapshot, parse
+        again.
+        """
+        if matcher is not self.pending_snapshot:
+            return
+        self.pending_snapshot = None
+        if change_count != self.view.change_count():
+            self.check_bracket_regions()
+            return
+        self.text = matcher.text
+        self.head_names = matcher.head_names
+        self.head_ids = matcher.head_ids
+        self.live_heads = matcher.live_heads
+        self.bracket_regions_trees = matcher.bracket_regions_trees
+        self.unclosed_trees = matcher.unclosed_trees
+        self.pair_count = matcher.pair_count
+        self.bracket_regions_lists = matcher.bracket_regions_lists
+        self.err_bracket_regions = matcher.err_bracket_regions
+        self.unclosed_bracket_regions = matcher.unclosed_bracket_regions
+        if self.coloring:
+            self.clear_bracket_regions()
+            self.publish_bracket_regions()
+
     # TODO: Update the bracket trees dynamically rather
     # than reconstruct them from beginning every time.
+    @profiled
     def check_bracket_regions(self):
+        # Supersedes the snapshot being scanned, if any
+        self.pending_snapshot = None
         if self.coloring:
             self.construct_bracket_trees_and_lists()
             self.clear_bracket_regions()
-            if self.bracket_regions_lists:
-                for level, regions in enumerate(self.bracket_regions_lists):
-                    self.view.add_regions(
-                        self.keys[level],
-                        regions,
-                        scope=self.scopes[level],
-                        flags=sublime.DRAW_NO_OUTLINE|sublime.PERSISTENT
-                    )
-            if self.err_bracket_regions:
-                self.view.add_regions(
-                    self.err_key,
-                    self.err_bracket_regions,
-                    scope=self.err_scope,
-                    flags=sublime.DRAW_EMPTY|sublime.PERSISTENT
-                )
+            self.publish_bracket_regions()
         else:
             self.construct_bracket_trees()
 
-    def clear_bracket_regions(self):
-        self.view.erase_regions(self.err_key)
-        for key in self.keys:
-            self.view.erase_regions(key)
+    def update_bracket_regions(self, changes: Sequence[sublime.TextChange]):
+        """
+        Bring the brackets up to date with the text changes, in the
+        order they were made. Edits that can't change the brackets are
+        applied by shifting the offsets, the regions already painted
+        are moved by the editor itself. Any other edit reparses.
+        """
+        if self.text is None or not self.shift_bracket_offsets(changes):
+            self.check_bracket_regions()
 
-    def construct_bracket_trees(self):
-        self.bracket_regions_trees = []
-
-        opening_stack   = []
-        tree_node_stack = [BracketTree(None, None, self.bracket_regions_trees)]
-
-        def handle_bracket_region(
-            bracket, region,
-            Node=BracketTree,
-            brackets=self.brackets,
-            opening_stack=opening_stack,
-            opening_stack_append=opening_stack.append,
-            opening_stack_pop=opening_stack.pop,
-            tree_node_stack=tree_node_stack,
-            tree_node_stack_append=tree_node_stack.append,
-            tree_node_stack_pop=tree_node_stack.pop
-        ):
-            if bracket in brackets:
-                tree_node_stack_append(Node(region, None, []))
-                opening_stack_append(bracket)
-
-            elif opening_stack and bracket == brackets[opening_stack[-1]]:
-                opening_stack_pop()
-                node = tree_node_stack_pop()
-                node.closing = region
-                tree_node_stack[-1].contain.append(node)
-
-        self._iterate_brackets(handle_bracket_region)
-
-    def construct_bracket_trees_and_lists(self):
-        self.err_bracket_regions   = []
-        self.bracket_regions_lists = []
-        self.bracket_regions_trees = []
-
-        opening_stack    = []
-        tree_node_stack  = [BracketTree(None, None, self.bracket_regions_trees)]
-        regions_by_layer = [list() for _ in range(self.color_number)]
-
-        def handle_bracket_region(
-            bracket, region,
-            Node=BracketTree,
-            brackets=self.brackets,
-            num_layers=self.color_number,
-            opening_stack=opening_stack,
-            opening_stack_append=opening_stack.append,
-            opening_stack_pop=opening_stack.pop,
-            tree_node_stack=tree_node_stack,
-            tree_node_stack_append=tree_node_stack.append,
-            tree_node_stack_pop=tree_node_stack.pop,
-            appends=[rs.append for rs in regions_by_layer]
-        ):
-            if bracket in brackets:
-                tree_node_stack_append(Node(region, None, []))
-                opening_stack_append(bracket)
-
-            elif opening_stack and bracket == brackets[opening_stack[-1]]:
-                opening_stack_pop()
-                node = tree_node_stack_pop()
-                node.closing = region
-                tree_node_stack[-1].contain.append(node)
-                layer = len(opening_stack) % num_layers
-                appends[layer](node.opening)
-                appends[layer](node.closing)
-            else:
-                self.err_bracket_regions.append(region)
+    def shift_bracket_offsets(self, changes: Sequence[sublime.TextChange]):
+        text = self.text
+        n = self.max_token_len - 1
+        # Where the edits end in the parsed text, and the shifts of the
+        # offsets from each of these bounds, `shifts[0]` is before them
+        bounds: List[int] = []
+        shifts = [0]
+        # The edited spans in the updated text
+        spans: List[Tuple[int, int]] = []
+        pieces: List[str] = []
+        last = 0
+        for change in changes:
+            # The positions of the parsed text
+            a = change.a.pt - shifts[-1]
+            b = change.b.pt - shifts[-1]
+            inserted = change.str
+            # The edits of multiple cursors follow each other, so the
+            # span of an edit is not moved by the next ones. They must
+            # be a token apart, so that each of them is checked against
+            # the parsed text.
+            if bounds and a < last + n:
+                return False
+            if not self._is_plain_edit(text, a, b, inserted):
+                return False
+            pieces.append(text[last:a])
+            pieces.append(inserted)
+            last = b
+            bounds.append(b)
+            shifts.append(shifts[-1] + len(inserted) - (b - a))
+            spans.append((change.a.pt, change.a.pt + len(inserted)))
+        pieces.append(text[last:])
+        if any(shifts):
+            self._shift_trees(bounds, shifts)
+            for offsets in self.bracket_regions_lists:
+                self._shift_layer(offsets, bounds, shifts)
+            self._shift_pairs(self.err_bracket_regions, bounds, shifts)
+        self.text = text = ''.join(pieces)
+        for a, _ in spans:
+            node = self._innermost_tree(a)
+            if (node is not None and
+                a <= node.ob + len(self.head_names[node.head])):
+                node.head = self._head_at(text, node.ob)
+        # The heads replaced by the edits stay in the table until then
+        if len(self.head_names) > 2 * self.live_heads + HEAD_TABLE_SLACK:
+            self.compact_heads()
+        if self.selector:
+            return self._spans_keep_scopes(spans)
+        return True
 
-        self._iterate_brackets(handle_bracket_region)
-        self.bracket_regions_lists = [ls for ls in regions_by_layer if ls]
+    def _is_plain_edit(self, text: str, a: int, b: int, inserted: str):
+        if not (PLAIN_TEXT.fullmatch(inserted) and
+                PLAIN_TEXT.fullmatch(text, a, b)):
+            return False
+        # Neither a bracket is touched, nor formed by the joined text
+        n = self.max_token_len - 1
+        lo = max(a - n, 0)
+        if self.regexp.search(text, lo, b + n):
+            return False
+        return self.regexp.search(text[lo:a] + inserted + text[b:b + n]) is None
 
-    def _iterate_brackets(
-        self,
-        handle: Callable[[str, sublime.Region], None],
-        Region=sublime.Region
-    ):
-        full_text = self.view.substr(Region(0, self.view.size()))
-        matches = self.regexp.finditer(full_text)
+    def _spans_keep_scopes(self, spans):
+        """
+        Whether the edited spans lie within ignored scopes or outside of
+        them, rather than on one of their boundaries, and the brackets
+        next to them are still ignored or parsed as they were.
+        """
         ignore = self.view.match_selector
-        ignored_scope_selector = self.selector
-        if ignored_scope_selector:
-            for m in matches:
-                if ignore(m.span()[0], ignored_scope_selector):
-                    continue
-                handle(m.group(), Region(*m.span()))
-        else:
-            for m in matches:
-                handle(m.group(), Region(*m.span()))
+        selector = self.selector
+        text = self.text
+        size = len(text)
+        n = self.max_token_len
+        for begin, end in spans:
+            points = {max(begin - 1, 0), min(end, size)}
+            if end > begin:
+                points.add(begin)
+            if len({ignore(pt, selector) for pt in points}) > 1:
+                return False
+            # An ignored scope may have grown over a bracket, or drawn
+            # back from one, such as `#\a(` turned into `#\(`. Check the
+            # brackets from before the edit on, until one after it is
+            # still parsed, or the line of the edit ends.
+            line_end = text.find('\n', end)
+            if line_end < 0:
+                line_end = size
+            for m in self.regexp.finditer(text, max(begin - n, 0)):
+                point = m.start()
+                if point > line_end:
+                    break
+                parsed = self._is_parsed_bracket(point)
+                if ignore(point, selector) == parsed:
+                    return False
+                if point >= end and parsed:
+                    break
+        return True
+
+    def _is_parsed_bracket(self, point: int) -> bool:
+        """
+        Whether a bracket of the parse begins at `point`.
+        """
+        forests = [self.bracket_regions_trees]
+        for node in self.unclosed_trees:
+            if node.oa == point:
+                return True
+            forests.append(node.contain)
+        for trees in forests:
+            while trees:
+                lo, hi = 0, len(trees)
+                while lo < hi:
+                    mi = (lo + hi) >> 1
+                    if trees[mi].cb <= point:
+                        lo = mi + 1
+                    else:
+                        hi = mi
+                if lo == len(trees):
+                    break
+                node = trees[lo]
+                if node.oa == point or node.ca == point:
+                    return True
+                if not node.ob <= point < node.ca:
+                    break
+                trees = node.contain
+        errors = self.err_bracket_regions
+        lo, hi = 0, len(errors) >> 1
+        while lo < hi:
+            mi = (lo + hi) >> 1
+            if errors[mi << 1] < point:
+                lo = mi + 1
+            else:
+                hi = mi
+        return lo < len(errors) >> 1 and errors[lo << 1] == point
+
+    def _shift_trees(self, bounds: List[int], shifts: List[int]):
+        """
+        Move the brackets beginning at or after the first bound, each by
+        the shift of the last bound it is at or after.
+        """
+        self._shift_forest(self.bracket_regions_trees, bounds, shifts)
+        for node in self.unclosed_trees:
+            shift = shifts[bisect_right(bounds, node.oa)]
+            node.oa += shift
+            node.ob += shift
+            self._shift_forest(node.contain, bounds, shifts)
+
+    @staticmethod
+    def _shift_forest(trees: List[BracketTree], bounds: List[int], shifts: List[int]):
+        point = bounds[0]
+        last = bounds[-1]
+        total = shifts[-1]
+        while trees:
+            # Skip the trees closed before `point`
+            lo, hi = 0, len(trees)
+            while lo < hi:
+                mi = (lo + hi) >> 1
+                if trees[mi].cb <= point:
+                    lo = mi + 1
+                else:
+                    hi = mi
+            enclosing = None
+            if lo < len(trees) and trees[lo].oa < point:
+                enclosing = trees[lo]
+                lo += 1
+            stack = trees[lo:]
+            while stack:
+                node = stack.pop()
+                if node.oa >= last:
+                    node.oa += total
+                    node.ob += total
+                    node.ca += total
+                    node.cb += total
+                else:
+                    shift = shifts[bisect_right(bounds, node.oa)]
+                    node.oa += shift
+                    node.ob += shift
+                    shift = shifts[bisect_right(bounds, node.ca)]
+                    node.ca += shift
+                    node.cb += shift
+                stack.extend(node.contain)
+            if enclosing is None:
+                break
+            shift = shifts[bisect_right(bounds, enclosing.ca)]
+            enclosing.ca += shift
+            enclosing.cb += shift
+            trees = enclosing.contain
+
+    @staticmethod
+    def _shift_layer(offsets: Offsets, bounds: List[int], shifts: List[int]):
+        # The pairs of a layer are stored in the order they are closed,
+        # skip the ones closed before the first bound
+        point = bounds[0]
+        lo, hi = 0, len(offsets) >> 2
+        while lo < hi:
+            mi = (lo + hi) >> 1
+            if offsets[(mi << 2) + 2] < point:
+                lo = mi + 1
+            else:
+                hi = mi
+        last = bounds[-1]
+        total = shifts[-1]
+        for i in range(lo << 2, len(offsets), 2):
+            begin = offsets[i]
+            if begin >= last:
+                shift = total
+            elif begin >= point:
+                shift = shifts[bisect_right(bounds, begin)]
+            else:
+                continue
+            offsets[i] = begin + shift
+            offsets[i + 1] += shift
+
+    @staticmethod
+    def _shift_pairs(offsets: Offsets, bounds: List[int], shifts: List[int]):
+        # The pairs are in the order of the text
+        point = bounds[0]
+        lo, hi = 0, len(offsets) >> 1
+        while lo < hi:
+            mi = (lo + hi) >> 1
+            if offsets[mi << 1] < point:
+                lo = mi + 1
+            else:
+                hi = mi
+        for i in range(lo << 1, len(offsets), 2):
+            shift = shifts[bisect_right(bounds, offsets[i])]
+            offsets[i] += shift
+            offsets[i + 1] += shift
+
+    def publish_bracket_regions(self):
+        if self.bracket_regions_lists:
+            for level, offsets in enumerate(self.bracket_regions_lists):
+                self.view.add_regions(
+                    self.keys[level],
+                    to_regions(offsets),
+                    scope=self.scopes[level],
+                    flags=sublime.DRAW_NO_OUTLINE|sublime.PERSISTENT
+                )
+        if self.err_bracket_regions:
+            self.view.add_regions(
+                self.err_key,
+                to_regions(self.err_bracket_regions),
+                scope=self.err_scope,
+                flags=sublime.DRAW_EMPTY|sublime.PERSISTENT
+            )
+
+    def clear_bracket_regions(self):
+        self.clear_active_pairs()
+        self.view.erase_regions(self.err_key)
+        for key in self.keys:
+            self.view.erase_regions(key)
@@ -1,5 +1,3 @@
-import json
-
 from .consts import PACKAGE_NAME
 
 
@@ -12,16 +10,23 @@ class Logger():
         if cls.debug:
             print(f"{cls.employer}:", *args, **kwargs)
 
+    @classmethod
+    def warn(cls, *args, **kwargs):
+        print(f"{cls.employer}: warning:", *args, **kwargs)
+
     @classmethod
     def pprint(cls, obj):
+        if not cls.debug:
+            return
+
+        import json
+
         class setEncoder(json.JSONEncoder):
             def default(self, obj):
                 if isinstance(obj, set):
                     return sorted(obj)
                 return json.JSONEncoder.default(self, obj)
 
-        if cls.debug:
-            print(f"{cls.employer}:", json.dumps(obj,
-                cls=setEncoder, indent=4,
-                sort_keys=True, ensure_ascii=False))
-
+        print(f"{cls.employer}:", json.dumps(obj,
+            cls=setEncoder, indent=4,
+            sort_keys=True, ensure_ascii=False))
@@ -1,61 +1,53 @@
-import re
 import os
+import time
 import sublime
 import sublime_plugin
 
 from collections import ChainMap
-from typing import Any, Dict, Mapping, Optional, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Tuple
 
 from .color_scheme  import cs_mgr
 from .consts        import PACKAGE_NAME
 from .consts        import SETTINGS_FILE
 from .logger        import Logger
+from .engine        import compile_config
 from .executor      import RainbowBracketsExecutor
+from .memory        import executor_memory_estimate
+from .memory        import format_size
+from .memory        import memory_usages
 
 
 def show_error_message(msg: str):
     sublime.error_message(f'{PACKAGE_NAME}: {msg}')
 
 
-def compile_config(
-    config: Dict[str, Any],
-    syntax: Optional[str],
-    is_default: bool,
-    scope_color_map: Dict[str, str]
-):
-    color_cycle = config.get('color.cycle', [])
-    color_error = config.get('color.error')
-    if color_cycle:
-        scopes = config['scopes'] = []
-        keys = config['keys'] = []
-        for i, color in enumerate(color_cycle):
-            if is_default:
-                key   = f'_rb_l{i}'
-                scope = f'l{i}._rb'
-            else:
-                key   = f'_rb_l{i}_{syntax}'
-                scope = f'{syntax}.l{i}._rb'
-            keys.append(key)
-            scopes.append(scope)
-            scope_color_map[scope] = color
-        config['keys']   = keys
-        config['scopes'] = scopes
-    if color_error is not None:
-        if is_default:
-            key   = f'_rb_error'
-            scope = f'error._rb'
+# Kinds of config changes, in increasing order of the work they require
+CONFIG_UNCHANGED  = 0
+CONFIG_COLORS     = 1  # only the colors, handled by the color scheme
+CONFIG_SCOPE_KEYS = 2  # region keys and scopes, brackets are reused
+CONFIG_STRUCTURAL = 3  # anything else, the brackets must be reparsed
+
+COLOR_KEYS = frozenset(('color.cycle', 'color.error', 'color.active'))
+SCOPE_KEYS = frozenset((
+    'keys', 'scopes', 'err_key', 'err_scope', 'active_key', 'active_scope'
+))
+
+
+def classify_config_change(
+    old: Mapping[str, Any],
+    new: Mapping[str, Any]
+) -> int:
+    change = CONFIG_UNCHANGED
+    for key in set(old) | set(new):
+        if old.get(key) == new.get(key):
+            continue
+        if key in COLOR_KEYS:
+            change = max(change, CONFIG_COLORS)
+        elif key in SCOPE_KEYS:
+            change = max(change, CONFIG_SCOPE_KEYS)
         else:
-            key   = f'_rb_error_{syntax}'
-            scope = f'{syntax}.error._rb'
-        config['err_key']   = key
-        config['err_scope'] = scope
-        scope_color_map[scope] = color_error
-    if 'bracket_pairs' in config:
-        pairs = config['bracket_pairs']
-        brackets = sorted(list(pairs.keys()) + list(pairs.values()))
-        config['pattern']  = '|'.join(re.escape(b) for b in brackets)
-    if 'ignored_scopes' in config:
-        config['selector'] = '|'.join(config['ignored_scopes'])
+            return CONFIG_STRUCTURAL
+    return change
 
 
 class RainbowBracketsViewManager(sublime_plugin.EventListener):
@@ -63,14 +55,20 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
     configs_by_stx = {}
     syntaxes_by_ext: Dict[str, str] = {}
     view_executors: Dict[int, RainbowBracketsExecutor] = {}
+    reload_workers = 4
+    memory_ceiling = 0
+    memory_exceeded = False
     is_ready = False
 
     @classmethod
     def init(cls):
+        start = time.time()
         cls.settings = sublime.load_settings(SETTINGS_FILE)
         cls.settings.add_on_change(PACKAGE_NAME, cls.reload)
         cls.load_config()
         cls.check_load_active_view()
+        end = time.time()
+        Logger.print(f'Startup cost time: {end - start:>.3f}')
 
     @classmethod
     def exit(cls):
@@ -103,6 +101,7 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
                 syntaxes_by_ext[ext] = syntax
 
         Logger.debug = cls.settings.get('debug', False)
+        cls.memory_ceiling = int((cls.settings.get('memory_ceiling_mb') or 0) * 2**20)
         Logger.pprint(configs_by_stx)
 
         cs_mgr.set_colors(list(scope_color_map.items()))
@@ -115,6 +114,7 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
     @classmethod
     def reload_view_executors(cls):
         disabled_views = []
+        reloading = []
         for view_id in cls.view_executors:
             executor = cls.view_executors[view_id]
             view = executor.view
@@ -122,15 +122,70 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
             if not config['enabled']:
                 disabled_views.append(view)
                 continue
-            if (syntax == executor.syntax and
-                config == executor.config):
+            if syntax != executor.syntax:
+                change = CONFIG_STRUCTURAL
+            else:
+                change = classify_config_change(executor.config, config)
+            if change == CONFIG_UNCHANGED:
                 continue
-            Logger.print(f'Reloading {executor.view_file_name()}')
-            executor.clear_bracket_regions()
-            executor.__init__(view, syntax, config)
-            executor.load()
+            elif change == CONFIG_COLORS:
+                # The colors live in the color scheme only
+                executor.config = config
+            elif change == CONFIG_SCOPE_KEYS:
+                Logger.print(f'Rekeying {executor.view_file_name()}')
+                executor.rekey(config)
+            else:
+                Logger.print(f'Reloading {executor.view_file_name()}')
+                executor.clear_bracket_regions()
+                executor.__init__(view, syntax, config)
+                reloading.append(executor)
         for view in disabled_views:
             cls.close_view_executor(view)
+        if reloading:
+            cls.rescan_executors(reloading)
+
+    @classmethod
+    def rescan_executors(cls, executors: List[RainbowBracketsExecutor]):
+        """
+        Scan snapshots of the views in a pool of worker threads, the
+        results are applied on the main thread, visible views first.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        visible_view_ids = set()
+        for window in sublime.windows():
+            for group in range(window.num_groups()):
+                view = window.active_view_in_group(group)
+                if view:
+                    visible_view_ids.add(view.view_id)
+        executors.sort(key=lambda e: e.view.view_id not in visible_view_ids)
+
+        total = len(executors)
+        done = 0
+
+        def apply(future, executor, matcher, change_count):
+            nonlocal done
+            done += 1
+            sublime.status_message(
+                f'{PACKAGE_NAME}: reloaded {done}/{total} views')
+            if cls.view_executors.get(executor.view.view_id) is not executor:
+                return
+            try:
+                future.result()
+            except Exception as e:
+                Logger.print(f'Failed to scan {executor.view_file_name()}: {e}')
+                executor.check_bracket_regions()
+            else:
+                executor.adopt_snapshot(matcher, change_count)
+
+        pool = ThreadPoolExecutor(max_workers=cls.reload_workers)
+        for executor in executors:
+            matcher, change_count = executor.take_snapshot()
+            future = pool.submit(matcher.scan, executor.coloring)
+            future.add_done_callback(
+                lambda f, e=executor, m=matcher, c=change_count:
+                    sublime.set_timeout(lambda: apply(f, e, m, c)))
+        pool.shutdown(wait=False)
 
     @classmethod
     def check_view_add_executor(cls, view: sublime.View, force=False):
@@ -197,11 +252,34 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
         executor = view.size() and cls.check_view_add_executor(view)
         if executor and not executor.bracket_regions_trees:
             executor.load()
+            cls.check_memory_ceiling()
+
+    @classmethod
+    def memory_usages(cls):
+        return memory_usages(cls.view_executors.values(), cs_mgr)
+
+    @classmethod
+    def check_memory_ceiling(cls):
+        """
+        Warn once the estimated memory of the executors goes over the
+        ceiling, and again only after it went back under it.
+        """
+        if not cls.memory_ceiling:
+            return
+        total = sum(map(executor_memory_estimate, cls.view_executors.values()))
+        exceeded = total > cls.memory_ceiling
+        if exceeded and not cls.memory_exceeded:
+            Logger.warn(
+                f'using about {format_size(total)} of memory, more than '
+                f'the ceiling of {format_size(cls.memory_ceiling)}')
+        cls.memory_exceeded = exceeded
 
     @classmethod
     def setup_view_executor(cls, view: sublime.View):
         executor = cls.force_add_executor(view)
-        executor and executor.load()  # type: ignore
+        if executor:
+            executor.load()
+            cls.check_memory_ceiling()
 
     @classmethod
     def close_view_executor(cls, view: sublime.View):
@@ -250,10 +328,35 @@ class RainbowBracketsViewManager(sublime_plugin.EventListener):
     def on_activated(self, view: sublime.View):
         self.check_view_load_executor(view)
 
-    def on_modified(self, view: sublime.View):
+    def on_selection_modified(self, view: sublime.View):
         executor = self.view_executors.get(view.view_id, None)
-        executor and executor.check_bracket_regions()  # type: ignore
+        executor and executor.on_selection_modified()  # type: ignore
 
     def on_close(self, view: sublime.View):
         self.view_executors.pop(view.view_id, None)
         cs_mgr.detach_view(view)
+
+
+class RainbowBracketsTextListener(sublime_plugin.TextChangeListener):
+    @classmethod
+    def is_applicable(cls, buffer: sublime.Buffer):
+        return True
+
+    def executors(self):
+        get_executor = RainbowBracketsViewManager.get_view_executor
+        for view in self.buffer.views():  # type: ignore
+            executor = get_executor(view)
+            if executor:
+                yield executor
+
+    def on_text_changed(self, changes: List[sublime.TextChange]):
+        for executor in self.executors():
+            executor.update_bracket_regions(changes)
+
+    def on_revert(self):
+        for executor in self.executors():
+            executor.check_bracket_regions()
+
+    def on_reload(self):
+        for executor in self.executors():
+            executor.check_bracket_regions()
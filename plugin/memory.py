@@ -0,0 +1,151 @@
+import sys
+
+from typing import Dict, List, Optional, Set
+
+from .engine import BracketTree
+
+
+# The bytes taken by a bracket pair in the trees, its node, its list of
+# children and its offsets (see tests/test_allocations.py), and by an
+# offset in a layer
+PAIR_SIZE   = 264
+OFFSET_SIZE = 8
+
+
+def deep_sizeof(obj, seen: Optional[Set[int]] = None) -> int:
+    """
+    The size of `obj` and of the objects it holds, counting shared
+    objects once within `seen`. Only follows the builtin containers
+    and the bracket trees, which is what the executors are made of.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, BracketTree):
+            stack.extend((obj.oa, obj.ob, obj.ca, obj.cb, obj.contain))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+    return size
+
+
+def count_nodes(trees: List[BracketTree]) -> int:
+    count = 0
+    stack = [trees]
+    while stack:
+        trees = stack.pop()
+        count += len(trees)
+        stack.extend(node.contain for node in trees if node.contain)
+    return count
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+class MemoryUsage:
+    """
+    The sizes in bytes and the counts of the parts of an object.
+    """
+    def __init__(self, name: str, sizes: Dict[str, int], counts: Dict[str, int]):
+        self.name = name
+        self.sizes = sizes
+        self.counts = counts
+
+    @property
+    def total(self) -> int:
+        return sum(self.sizes.values())
+
+    def format(self) -> str:
+        counts = ', '.join(f'{k} {v}' for k, v in self.counts.items())
+        sizes = ', '.join(
+            f'{k} {format_size(v)}'
+            for k, v in sorted(self.sizes.items(), key=lambda i: -i[1])
+        )
+        return f'{self.name}: {format_size(self.total)}\n\t{counts}\n\t{sizes}'
+
+
+def executor_memory_usage(executor) -> MemoryUsage:
+    regions = sum(len(offsets) for offsets in executor.bracket_regions_lists)
+    regions += len(executor.err_bracket_regions)
+    seen: Set[int] = set()
+    return MemoryUsage(
+        f'{executor.view_file_name()} (view {executor.view.view_id})',
+        {
+            'trees': (
+                deep_sizeof(executor.bracket_regions_trees, seen) +
+                deep_sizeof(executor.unclosed_trees, seen)
+            ),
+            'layers': deep_sizeof(executor.bracket_regions_lists, seen),
+            'errors': (
+                sys.getsizeof(executor.err_bracket_regions) +
+                sys.getsizeof(executor.unclosed_bracket_regions)
+            ),
+            'heads': (
+                deep_sizeof(executor.head_names, seen) +
+                deep_sizeof(executor.head_ids, seen)
+            ),
+            'regexp': sys.getsizeof(executor.regexp),
+            'text': sys.getsizeof(executor.text) if executor.text else 0,
+        },
+        {
+            'nodes': count_nodes(executor.bracket_regions_trees),
+            'regions': regions >> 1,
+            'heads': len(executor.head_names) - 1,
+        }
+    )
+
+
+def executor_memory_estimate(executor) -> int:
+    """
+    An estimate of the size of an executor in bytes, in constant time,
+    from the number of bracket pairs and the sizes of its buffers.
+    """
+    offsets = sum(map(len, executor.bracket_regions_lists))
+    offsets += len(executor.err_bracket_regions)
+    size = executor.pair_count * PAIR_SIZE + offsets * OFFSET_SIZE
+    if executor.text:
+        size += sys.getsizeof(executor.text)
+    return size
+
+
+def color_scheme_memory_usage(cs_mgr) -> MemoryUsage:
+    return MemoryUsage(
+        'color schemes',
+        {
+            'plain_rules': deep_sizeof(cs_mgr.plain_rules),
+            'views': deep_sizeof(list(cs_mgr.view_current_cs.values())),
+            'refcounts': deep_sizeof(cs_mgr.cs_refcounts),
+            'generated texts': deep_sizeof(cs_mgr.cs_texts),
+        },
+        {
+            'plain_rules': len(cs_mgr.plain_rules),
+            'views': len(cs_mgr.view_current_cs),
+            'schemes in use': len(cs_mgr.cs_refcounts),
+            'generated texts': len(cs_mgr.cs_texts),
+        }
+    )
+
+
+def memory_usages(executors, cs_mgr) -> List[MemoryUsage]:
+    """
+    The memory usages of the executors and the color scheme manager,
+    sorted by size, largest first.
+    """
+    usages = [executor_memory_usage(e) for e in executors]
+    usages.append(color_scheme_memory_usage(cs_mgr))
+    usages.sort(key=lambda u: u.total, reverse=True)
+    return usages
@@ -0,0 +1,110 @@
+import os
+import time
+import functools
+
+import sublime
+
+from .consts import PACKAGE_NAME
+from .engine import BracketMatcher
+from .logger import Logger
+
+
+class Profiler():
+    """
+    Profile the next calls of the functions decorated by `profiled`,
+    and save the stats under the User package.
+    """
+    remaining = 0
+    top = 30
+    active = False
+    # The number of saved profiles, keeps apart those of the same second
+    captures = 0
+
+    @classmethod
+    def arm(cls, calls: int, top: int):
+        cls.remaining = calls
+        cls.top = top
+
+    @classmethod
+    def output_path(cls):
+        return os.path.join(
+            sublime.packages_path(), 'User', PACKAGE_NAME, 'profiles')
+
+    @classmethod
+    def runcall(cls, func, obj, *args, **kwargs):
+        import cProfile
+
+        cls.remaining -= 1
+        cls.active = True
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, obj, *args, **kwargs)
+        finally:
+            cls.active = False
+            try:
+                cls.save(profile, func.__qualname__, obj)
+            except Exception as e:
+                Logger.warn(f'failed to save profile: {e}')
+
+    @classmethod
+    def tags(cls, obj):
+        from .manager import RainbowBracketsViewManager
+        from .memory  import count_nodes
+
+        view = obj.view
+        syntax = view.syntax()
+        if isinstance(obj, BracketMatcher):
+            executor = obj
+        else:
+            executor = RainbowBracketsViewManager.get_view_executor(view)
+        brackets = 0
+        if executor:
+            brackets = 2 * count_nodes(executor.bracket_regions_trees)
+            brackets += len(executor.err_bracket_regions) >> 1
+        return {
+            'file': os.path.basename(view.file_name() or 'untitled'),
+            'syntax': syntax.name if syntax else None,
+            'size': view.size(),
+            'brackets': brackets,
+        }
+
+    @classmethod
+    def save(cls, profile, name: str, obj):
+        import io
+        import pstats
+
+        tags = cls.tags(obj)
+        cls.captures += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(
+            cls.output_path(),
+            f"{stamp}-{cls.captures}-{name}-{tags['file']}")
+        os.makedirs(cls.output_path(), exist_ok=True)
+        profile.dump_stats(base + '.pstats')
+
+        summary = io.StringIO()
+        for key, value in tags.items():
+            summary.write(f'{key}: {value}\n')
+        summary.write('\n')
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(cls.top)
+        with open(base + '.txt', 'w', encoding='utf-8') as file:
+            file.write(summary.getvalue())
+
+        sublime.status_message(
+            f'{PACKAGE_NAME}: saved profile {os.path.basename(base)}, '
+            f'{cls.remaining} calls left')
+        Logger.print(f'Saved profile {base}.pstats')
+
+
+def profiled(func):
+    """
+    Profile the calls of the method `func` while the profiler is armed,
+    the object it is called on must have a `view`.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if Profiler.remaining <= 0 or Profiler.active:
+            return func(self, *args, **kwargs)
+        return Profiler.runcall(func, self, *args, **kwargs)
+    return wrapper
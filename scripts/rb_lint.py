@@ -0,0 +1,294 @@
+"""
+Report mismatched brackets in a directory tree, as JSON lines, using
+the bracket matching rules of RainbowBrackets.
+
+    python3 scripts/rb_lint.py [--settings FILE] [--jobs N]
+                               [--skip-unreadable] PATH...
+
+Files are matched to a syntax by the `extensions` of `syntax_specific`.
+There is no syntax engine outside of the editor, so `ignored_scopes`
+are approximated by the lexical rules in `LEXICAL_SCOPES`.
+
+Exits with status 2 if a file could not be read, unless
+`--skip-unreadable` is given, else with status 1 if any mismatched
+bracket was found.
+"""
+import argparse
+import bisect
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+from collections import ChainMap
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+
+PACKAGE_PATH  = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_FILE = os.path.join(PACKAGE_PATH, 'RainbowBrackets.sublime-settings')
+SKIPPED_DIRS  = {'.git', '.hg', '.svn', '__pycache__', 'node_modules'}
+
+
+def _load_engine():
+    # Importing `plugin` as a package would require the `sublime` module
+    path = os.path.join(PACKAGE_PATH, 'plugin', 'engine.py')
+    spec = importlib.util.spec_from_file_location('rb_engine', path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+engine = _load_engine()
+
+
+STRING_DQ = r'"(?:\\.|[^"\\])*"'
+STRING_SQ = r"'(?:\\.|[^'\\\n])*'"
+LINE_COMMENT = r'//[^\n]*'
+BLOCK_COMMENT = r'/\*[\s\S]*?\*/'
+
+# Lexical approximations of the scopes of the syntaxes, as pairs of
+# a scope name and a regex, the `None` entry is for other syntaxes.
+LEXICAL_SCOPES = {
+    None: [
+        ('comment', f'{LINE_COMMENT}|{BLOCK_COMMENT}'),
+        ('string', f'{STRING_DQ}|{STRING_SQ}'),
+    ],
+    'Bash': [
+        ('comment', r'(?<![^\s;&|(])#[^\n]*'),
+        ('string', STRING_DQ + r"|'[^']*'"),
+    ],
+    'JSON': [
+        ('comment', f'{LINE_COMMENT}|{BLOCK_COMMENT}'),
+        ('string', STRING_DQ),
+    ],
+    'Regular Expression': [
+        ('comment', r'\(\?#[^)]*\)'),
+        ('constant', r'\\.'),
+        ('meta.set', r'\[\^?\]?(?:\\.|[^\]\\])*\]'),
+    ],
+    'Scheme': [
+        ('comment', r';[^\n]*|#\|[\s\S]*?\|#'),
+        ('string', STRING_DQ),
+        ('constant', r'#\\(?:x[0-9a-fA-F]+|[a-zA-Z]+|[\s\S])'),
+    ],
+}
+
+
+def load_settings(path: str) -> Dict[str, Any]:
+    """
+    Load a settings file, which may have comments and trailing commas.
+    """
+    with open(path, encoding='utf-8') as file:
+        text = file.read()
+    text = re.sub(
+        f'({STRING_DQ})|{LINE_COMMENT}|{BLOCK_COMMENT}',
+        lambda m: m.group(1) or '', text)
+    text = re.sub(
+        f'({STRING_DQ})|,(\\s*[}}\\]])',
+        lambda m: m.group(1) or m.group(2), text)
+    return json.loads(text)
+
+
+def load_configs(settings: Dict[str, Any]):
+    """
+    Compile the configs the same way the plugin does, returns the
+    configs by syntax and the syntaxes by extension.
+    """
+    default_config  = settings.get('default_config', {})
+    configs_by_stx  = settings.get('syntax_specific', {})
+    syntaxes_by_ext = {}
+
+    default_config.setdefault('coloring', False)
+    default_config.setdefault('enabled', True)
+
+    engine.compile_config(default_config, None, True, {})
+    for syntax, config in configs_by_stx.items():
+        engine.compile_config(config, syntax, False, {})
+        for ext in config.get('extensions', []):
+            syntaxes_by_ext[ext] = syntax
+
+    configs = {
+        syntax: ChainMap(config, default_config)
+        for syntax, config in configs_by_stx.items()
+    }
+    return configs, syntaxes_by_ext
+
+
+def compile_lexer(syntax: str, ignored_scopes: List[str]):
+    """
+    Compile a regex matching the text to skip, following the scopes of
+    `syntax` that are matched by one of the `ignored_scopes` selectors.
+    """
+    prefixes = set()
+    for selector in ignored_scopes:
+        for alternative in re.split(r'[|,]', selector):
+            scope = alternative.split(' - ')[0].strip().split(' ')[0]
+            if scope:
+                prefixes.add(scope)
+
+    def ignored(scope: str):
+        return any(
+            scope == prefix or scope.startswith(prefix + '.')
+            for prefix in prefixes
+        )
+
+    rules = LEXICAL_SCOPES.get(syntax, LEXICAL_SCOPES[None])
+    if not any(ignored(scope) for scope, _ in rules):
+        return None, []
+    # Every scope is lexed, so that the text of a scope that is kept
+    # doesn't start another one, a string in a comment for example
+    lexer = re.compile('|'.join(f'({regex})' for _, regex in rules))
+    return lexer, [False] + [ignored(scope) for scope, _ in rules]
+
+
+class FileBracketMatcher(engine.BracketMatcher):
+    collect_heads = False
+
+    def __init__(self, config: Mapping[str, Any], lexer, ignored_groups):
+        super().__init__(config)  # type: ignore
+        self.lexer = lexer
+        self.ignored_groups = ignored_groups
+        self.source = ''
+
+    def read_text(self) -> str:
+        """
+        The text of the file, with the ignored spans blanked out, which
+        keeps the offsets and the line breaks.
+        """
+        if self.lexer is None:
+            return self.source
+        ignored_groups = self.ignored_groups
+
+        def blank(m):
+            if ignored_groups[m.lastindex]:
+                return re.sub(r'[^\n]', ' ', m.group())
+            return m.group()
+
+        return self.lexer.sub(blank, self.source)
+
+
+# The matchers of the worker process, by syntax
+_matchers: Dict[str, FileBracketMatcher] = {}
+_syntaxes_by_ext: Dict[str, str] = {}
+
+
+def init_worker(settings_path: str):
+    configs, syntaxes_by_ext = load_configs(load_settings(settings_path))
+    for syntax, config in configs.items():
+        if not config['enabled'] or not config['bracket_pairs']:
+            continue
+        lexer, ignored_groups = compile_lexer(
+            syntax, config.get('ignored_scopes', []))
+        _matchers[syntax] = FileBracketMatcher(config, lexer, ignored_groups)
+    _syntaxes_by_ext.update(syntaxes_by_ext)
+
+
+def lint_file(path: str) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+    """
+    Returns the path, the mismatched brackets and an error message.
+    """
+    ext = os.path.splitext(path)[1]
+    matcher = _matchers[_syntaxes_by_ext[ext]]
+    try:
+        with open(path, encoding='utf-8') as file:
+            matcher.source = file.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return path, [], str(e)
+
+    text = matcher.source
+    matcher.construct_bracket_trees_and_lists()
+    mismatches = []
+    line_starts = None
+    for kind, offsets in (
+        ('unmatched', matcher.err_bracket_regions),
+        ('unclosed', matcher.unclosed_bracket_regions)
+    ):
+        if not offsets:
+            continue
+        if line_starts is None:
+            line_starts = [0] + [m.end() for m in re.finditer('\n', text)]
+        it = iter(offsets)
+        for a, b in zip(it, it):
+            row = bisect.bisect_right(line_starts, a) - 1
+            mismatches.append({
+                'path': path,
+                'line': row + 1,
+                'column': a - line_starts[row] + 1,
+                'offset': a,
+                'bracket': text[a:b],
+                'kind': kind,
+            })
+    mismatches.sort(key=lambda m: m['offset'])
+    matcher.source = ''
+    matcher.text = None
+    return path, mismatches, None
+
+
+def walk_files(paths: List[str], extensions) -> Iterator[str]:
+    for path in paths:
+        if os.path.isfile(path):
+            if os.path.splitext(path)[1] in extensions:
+                yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS]
+            for name in files:
+                if os.path.splitext(name)[1] in extensions:
+                    yield os.path.join(root, name)
+
+
+def report(results, skip_unreadable: bool) -> int:
+    """
+    Print the results of `lint_file`, returns the exit status.
+    """
+    found = False
+    unreadable = False
+    for path, mismatches, error in results:
+        if error is not None:
+            print(f'{path}: {error}', file=sys.stderr)
+            unreadable = True
+        for mismatch in mismatches:
+            print(json.dumps(mismatch, ensure_ascii=False))
+        found = found or bool(mismatches)
+    if unreadable and not skip_unreadable:
+        return 2
+    return 1 if found else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Report mismatched brackets as JSON lines.')
+    parser.add_argument('paths', nargs='+', metavar='PATH')
+    parser.add_argument(
+        '--settings', default=SETTINGS_FILE,
+        help='RainbowBrackets settings file (default: the packaged one)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='number of worker processes, 1 lints in this process '
+             '(default: number of CPUs)')
+    parser.add_argument(
+        '--skip-unreadable', action='store_true',
+        help="don't fail on the files that could not be read")
+    args = parser.parse_args(argv)
+
+    # The extensions of the syntaxes enabled in the settings
+    init_worker(args.settings)
+    extensions = {
+        ext for ext, syntax in _syntaxes_by_ext.items()
+        if syntax in _matchers
+    }
+
+    files = walk_files(args.paths, extensions)
+    if args.jobs <= 1:
+        return report(map(lint_file, files), args.skip_unreadable)
+    with multiprocessing.Pool(
+        args.jobs, initializer=init_worker, initargs=(args.settings,)
+    ) as pool:
+        results = pool.imap_unordered(lint_file, files, chunksize=64)
+        return report(results, args.skip_unreadable)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Benchmark of the `rb_edit_brackets` operations on synthetic bracket
+trees, with many cursors, deep nesting and many siblings.
+
+It needs the `sublime` module, run it from the console of Sublime Text:
+
+    from RainbowBrackets.tests import benchmark_edit_brackets as b; b.run()
+
+The command drives a stand-in view, which records the View API calls.
+It only applies the replacements of brackets, which keep the offsets
+of the trees, so every run sees the same trees. For each operation, the
+latency and the number of calls are printed, and saved as JSON lines if
+`output` is given.
+
+`transform` is run twice in a row. The first run turns the pairs of the
+cursors into the target brackets, so the second one walks outward
+through the nesting, the number of walked levels is recorded as
+`iterations`.
+"""
+import json
+import time
+
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+import sublime
+
+from ..plugin.commands import RbEditBracketsCommand
+from ..plugin.engine   import BracketMatcher
+from ..plugin.engine   import compile_config
+from ..plugin.manager  import RainbowBracketsViewManager as _manager
+
+
+CURSOR_STEPS  = (1, 10, 100, 1000, 10000)
+DEPTH_STEPS   = (10, 100, 1000)
+SIBLING_STEPS = (1000, 10000, 100000, 1000000)
+
+OPERATIONS = (
+    ('select', {}),
+    ('select', {'to': 'define|let'}),
+    ('remove', {'select_content': False}),
+    ('remove', {'select_content': True}),
+    ('transform', {'to': '['}),
+)
+
+
+class StandInSelection:
+    def __init__(self, calls: Counter, regions: List[sublime.Region]):
+        self.calls = calls
+        self.regions = regions
+
+    def __iter__(self):
+        return iter(list(self.regions))
+
+    def __len__(self):
+        return len(self.regions)
+
+    def add(self, region: sublime.Region):
+        self.calls['sel().add'] += 1
+        self.regions.append(region)
+
+    def add_all(self, regions):
+        self.calls['sel().add_all'] += 1
+        self.regions.extend(regions)
+
+
+class StandInView:
+    """
+    Implements the part of `sublime.View` used by the command.
+    """
+    def __init__(self, text: str, cursors: List[int]):
+        self.view_id = -id(self)
+        # The synthetic text is ASCII, a replacement is done in place
+        self.text = bytearray(text, 'ascii')
+        self.calls = Counter()
+        self.selection = StandInSelection(
+            self.calls, [sublime.Region(pt) for pt in cursors])
+
+    def sel(self):
+        return self.selection
+
+    def substr(self, region: sublime.Region):
+        self.calls['substr'] += 1
+        return self.text[region.begin():region.end()].decode('ascii')
+
+    def erase(self, edit, region: sublime.Region):
+        self.calls['erase'] += 1
+
+    def replace(self, edit, region: sublime.Region, text: str):
+        self.calls['replace'] += 1
+        if len(text) == region.size():
+            self.text[region.begin():region.end()] = text.encode('ascii')
+
+
+class SyntheticMatcher(BracketMatcher):
+    def __init__(self, text: str):
+        config = {
+            'bracket_pairs': {'(': ')', '[': ']', '{': '}'},
+            'color.cycle': ['#FFFFFF'],
+            'ignored_scopes': [],
+        }
+        compile_config(config, None, True, {})
+        super().__init__(config)
+        self.source = text
+        self.construct_bracket_trees()
+
+    def read_text(self) -> str:
+        return self.source
+
+
+def sibling_case(siblings: int, cursors: int):
+    """
+    `siblings` pairs in a pair, a cursor in each of the first ones.
+    """
+    text = '(' + '(define x) ' * siblings + ')'
+    points = [1 + i * 11 + 2 for i in range(min(cursors, siblings))]
+    return text, points
+
+
+def nesting_case(depth: int, cursors: int):
+    """
+    `depth` nested pairs, a cursor right after each of the outer ones.
+    """
+    text = '(let ' * depth + ')' * depth
+    points = [i * 5 + 1 for i in range(min(cursors, depth))]
+    return text, points
+
+
+def cases(
+    cursor_steps=CURSOR_STEPS,
+    depth_steps=DEPTH_STEPS,
+    sibling_steps=SIBLING_STEPS
+) -> Iterator[Dict[str, Any]]:
+    for siblings in sibling_steps:
+        for cursors in cursor_steps:
+            if cursors <= siblings:
+                yield {'case': 'siblings', 'siblings': siblings,
+                       'depth': 2, 'cursors': cursors}
+    for depth in depth_steps:
+        for cursors in cursor_steps:
+            if cursors <= depth:
+                yield {'case': 'nesting', 'siblings': 1,
+                       'depth': depth, 'cursors': cursors}
+
+
+def measure(matcher: SyntheticMatcher, points: List[int], operation, args):
+    view = StandInView(matcher.source, points)
+    _manager.view_executors[view.view_id] = matcher  # type: ignore
+    try:
+        command = RbEditBracketsCommand(view)
+        if operation == 'transform':
+            # Repeated right away, the second run looks farther away
+            command.run(None, operation=operation, **args)
+            view.calls.clear()
+            find_cursor_brackets = command._find_cursor_brackets
+
+            def counted(*args, **kwargs):
+                view.calls['iterations'] += 1
+                return find_cursor_brackets(*args, **kwargs)
+            command._find_cursor_brackets = counted  # type: ignore
+        start = time.perf_counter()
+        command.run(None, operation=operation, **args)
+        latency = time.perf_counter() - start
+    finally:
+        _manager.view_executors.pop(view.view_id, None)
+    return latency, dict(view.calls)
+
+
+def run(output: Optional[str] = None, **steps) -> List[Dict[str, Any]]:
+    """
+    Run the benchmark, the steps of `cases` can be given to run
+    a part of it.
+    """
+    results = []
+    trees = {}
+    for case in cases(**steps):
+        if case['case'] == 'siblings':
+            text, points = sibling_case(case['siblings'], case['cursors'])
+        else:
+            text, points = nesting_case(case['depth'], case['cursors'])
+        # The trees only depend on the shape
+        key = (case['case'], case['siblings'], case['depth'])
+        if key not in trees:
+            trees.clear()
+            trees[key] = SyntheticMatcher(text)
+        matcher = trees[key]
+        for operation, args in OPERATIONS:
+            latency, calls = measure(matcher, points, operation, args)
+            result = dict(case, operation=operation, args=args,
+                          latency=latency, calls=calls)
+            results.append(result)
+            print(
+                f"{case['case']:<8} siblings={case['siblings']:<7} "
+                f"depth={case['depth']:<4} cursors={case['cursors']:<5} "
+                f"{operation:<9} {json.dumps(args):<26} "
+                f"{latency * 1000:>9.2f} ms  {calls}"
+            )
+    if output:
+        with open(output, 'w') as file:
+            for result in results:
+                file.write(json.dumps(result) + '\n')
+    return results
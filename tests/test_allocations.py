@@ -0,0 +1,154 @@
+"""
+Memory retained by the bracket scan, per bracket, measured with
+tracemalloc on a synthetic buffer.
+
+Run it with the UnitTesting package, or print the numbers from the
+console of Sublime Text:
+
+    from RainbowBrackets.tests import test_allocations as t; t.run()
+
+The scan keeps the brackets as integer offsets. It is compared with
+`RegionMatcher`, which keeps a region per bracket in the trees and the
+layers, as the plugin did before.
+"""
+import gc
+import tracemalloc
+import unittest
+
+from typing import Any, Callable, Dict, List
+
+import sublime
+
+from ..plugin.engine import BracketMatcher
+from ..plugin.engine import compile_config
+
+
+# Upper bounds of what the scan retains per bracket, a tree node, its
+# list of children and the offsets take about 3.2 blocks and 150 bytes
+MAX_BLOCKS_PER_BRACKET = 3.5
+MAX_BYTES_PER_BRACKET  = 160
+
+
+def synthetic_config() -> Dict[str, Any]:
+    config = {
+        'bracket_pairs': {'(': ')', '[': ']', '{': '}'},
+        'color.cycle': ['#FF0000', '#00FF00', '#0000FF'],
+        'ignored_scopes': [],
+    }
+    compile_config(config, None, True, {})
+    return config
+
+
+def synthetic_text(pairs: int) -> str:
+    """
+    `pairs` bracket pairs, nested up to 3 levels.
+    """
+    unit = '(define (f x) [let {y x}] (g y))\n'
+    return unit * (pairs // 5)
+
+
+class TextMatcher(BracketMatcher):
+    def __init__(self, text: str):
+        super().__init__(synthetic_config())
+        self.source = text
+
+    def read_text(self) -> str:
+        return self.source
+
+
+class RegionTree:
+    __slots__ = ['opening', 'closing', 'contain']
+
+    def __init__(self, opening, closing, contain: List['RegionTree']):
+        self.opening = opening
+        self.closing = closing
+        self.contain = contain
+
+
+class RegionMatcher(TextMatcher):
+    """
+    Keeps a region per bracket, in the trees and the layers.
+    """
+    def construct_bracket_trees_and_lists(self):
+        self.err_bracket_regions   = []
+        self.bracket_regions_lists = []
+        self.bracket_regions_trees = []
+
+        opening_stack    = []
+        tree_node_stack  = [RegionTree(None, None, self.bracket_regions_trees)]
+        regions_by_layer = [[] for _ in range(self.color_number)]
+        brackets = self.brackets
+        Region = sublime.Region
+
+        for m in self.regexp.finditer(self.read_text()):
+            bracket = m.group()
+            region = Region(*m.span())
+            if bracket in brackets:
+                tree_node_stack.append(RegionTree(region, None, []))
+                opening_stack.append(bracket)
+            elif opening_stack and bracket == brackets[opening_stack[-1]]:
+                opening_stack.pop()
+                node = tree_node_stack.pop()
+                node.closing = region
+                tree_node_stack[-1].contain.append(node)
+                regions = regions_by_layer[len(opening_stack) % self.color_number]
+                regions.append(node.opening)
+                regions.append(region)
+            else:
+                self.err_bracket_regions.append(region)
+
+        self.bracket_regions_lists = [ls for ls in regions_by_layer if ls]
+
+
+def measure(build: Callable[[], None], brackets: int) -> Dict[str, float]:
+    """
+    The blocks and bytes per bracket retained by `build`.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        build()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'lineno')
+    return {
+        'blocks': sum(stat.count_diff for stat in stats) / brackets,
+        'bytes': sum(stat.size_diff for stat in stats) / brackets,
+    }
+
+
+def measure_scans(pairs: int = 50000) -> Dict[str, Dict[str, float]]:
+    text = synthetic_text(pairs)
+    usages = {}
+    for name, matcher in (
+        ('offsets', TextMatcher(text)),
+        ('regions', RegionMatcher(text))
+    ):
+        usages[name] = measure(matcher.construct_bracket_trees_and_lists, pairs * 2)
+    return usages
+
+
+def run(pairs: int = 50000):
+    for name, usage in measure_scans(pairs).items():
+        print(f"{name:<8} {usage['blocks']:>5.2f} blocks "
+              f"{usage['bytes']:>7.1f} bytes per bracket")
+
+
+class TestScanAllocations(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.usages = measure_scans()
+
+    def test_retained_per_bracket(self):
+        offsets = self.usages['offsets']
+        self.assertLessEqual(offsets['blocks'], MAX_BLOCKS_PER_BRACKET)
+        self.assertLessEqual(offsets['bytes'], MAX_BYTES_PER_BRACKET)
+
+    def test_saved_per_bracket(self):
+        offsets = self.usages['offsets']
+        regions = self.usages['regions']
+        # At least the region of each bracket is saved
+        self.assertGreaterEqual(round(regions['blocks'] - offsets['blocks'], 2), 1)
+        self.assertLess(offsets['bytes'], regions['bytes'])
@@ -0,0 +1,208 @@
+"""
+Tests of the reference counts of the generated color schemes, and of
+their collection from the cache directory.
+
+Run them with the UnitTesting package. The manager drives stand-in
+views and settings, and writes to a temporary directory. The timeouts
+it sets are queued and run by the tests.
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import sublime
+
+from ..plugin.color_scheme import ColorSchemeManager
+from ..plugin.color_scheme import MANIFEST_FILE
+from ..plugin.color_scheme import builtin_color_names
+from ..plugin.color_scheme import cs_file_name
+
+
+MONOKAI = 'Packages/Color Scheme - Default/Monokai.sublime-color-scheme'
+MARIANA = 'Packages/Color Scheme - Default/Mariana.sublime-color-scheme'
+
+
+class StandInSettings:
+    def __init__(self, values: Dict[str, Any]):
+        self.values = values
+        self.callbacks: Dict[str, Callable[[], None]] = {}
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key: str, value):
+        self.values[key] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def add_on_change(self, tag: str, callback: Callable[[], None]):
+        self.callbacks[tag] = callback
+
+    def clear_on_change(self, tag: str):
+        self.callbacks.pop(tag, None)
+
+
+class StandInView:
+    """
+    Implements the part of `sublime.View` used by the manager.
+    """
+    def __init__(self, color_scheme: str):
+        self.view_settings = StandInSettings({'color_scheme': color_scheme})
+
+    def settings(self):
+        return self.view_settings
+
+    def style(self) -> Dict[str, str]:
+        style = {name: f'#0000{i:02x}' for i, name in enumerate(builtin_color_names)}
+        style['background'] = '#272822'
+        return style
+
+
+class ColorSchemeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # A manager of its own, apart from the one of the plugin
+        mgr = self.mgr = object.__new__(ColorSchemeManager)
+        mgr.plain_rules = {}
+        mgr.view_current_cs = {}
+        mgr.cs_refcounts = {}
+        mgr.cs_texts = {}
+        mgr._cache_path = Path(self.directory.name)
+        mgr.set_colors([('l0._rb', '#FF0000'), ('error._rb', '#FF0000')])
+
+        self.timeouts: List[Callable[[], None]] = []
+        self.async_timeouts: List[Callable[[], None]] = []
+        self.saved = sublime.set_timeout, sublime.set_timeout_async
+        sublime.set_timeout = lambda f, delay=0: self.timeouts.append(f)
+        sublime.set_timeout_async = (
+            lambda f, delay=0: self.async_timeouts.append(f))
+
+    def tearDown(self):
+        sublime.set_timeout, sublime.set_timeout_async = self.saved
+        self.directory.cleanup()
+
+    def run_timeouts(self):
+        timeouts = self.timeouts + self.async_timeouts
+        self.timeouts.clear()
+        self.async_timeouts.clear()
+        for callback in timeouts:
+            callback()
+
+    def refcounts(self) -> Dict[str, int]:
+        return dict(self.mgr.cs_refcounts)
+
+    def write_file(self, name: str, size: int, mtime: int):
+        path = self.mgr.cache_path().joinpath(name)
+        path.write_text('x' * size)
+        os.utime(path, (mtime, mtime))
+        self.mgr.load_manifest()[name] = 'fingerprint'
+
+    def cached_files(self) -> List[str]:
+        return sorted(
+            file.name for file in self.mgr.cache_path().iterdir()
+            if file.name != MANIFEST_FILE)
+
+
+class TestRefcounts(ColorSchemeTestCase):
+    def test_attach_and_detach(self):
+        views = [StandInView(MONOKAI), StandInView(MONOKAI)]
+        for view in views:
+            self.mgr.attach_view(view)
+        self.assertEqual(self.refcounts(), {cs_file_name(MONOKAI): 2})
+        self.mgr.detach_view(views[0])
+        self.assertEqual(self.refcounts(), {cs_file_name(MONOKAI): 1})
+        self.assertFalse(self.async_timeouts)
+        self.mgr.detach_view(views[1])
+        self.assertEqual(self.refcounts(), {})
+        self.assertEqual(len(self.async_timeouts), 1)
+        # Detached views are not counted again
+        self.mgr.detach_view(views[1])
+        self.assertEqual(self.refcounts(), {})
+
+    def test_attach_attached_view(self):
+        # As when the executor of a view is closed and added again,
+        # the view stays attached
+        view = StandInView(MONOKAI)
+        self.mgr.attach_view(view)
+        self.mgr.attach_view(view)
+        self.assertEqual(self.refcounts(), {cs_file_name(MONOKAI): 1})
+        self.mgr.detach_view(view)
+        self.assertEqual(self.refcounts(), {})
+
+    def test_color_scheme_changed(self):
+        view = StandInView(MONOKAI)
+        self.mgr.attach_view(view)
+        self.run_timeouts()
+        view.settings().set('color_scheme', MARIANA)
+        self.assertEqual(self.refcounts(), {cs_file_name(MARIANA): 1})
+        self.run_timeouts()
+        self.assertEqual(
+            self.cached_files(),
+            [cs_file_name(MARIANA), cs_file_name(MONOKAI)])
+        # Other settings leave the counts as they are
+        view.settings().set('font_size', 12)
+        self.assertEqual(self.refcounts(), {cs_file_name(MARIANA): 1})
+        self.mgr.detach_view(view)
+        self.assertEqual(self.refcounts(), {})
+        self.assertFalse(view.settings().callbacks)
+
+    def test_collection_scheduled_once(self):
+        views = [StandInView(MONOKAI), StandInView(MARIANA)]
+        for view in views:
+            self.mgr.attach_view(view)
+        self.timeouts.clear()
+        for view in views:
+            self.mgr.detach_view(view)
+        self.assertTrue(self.mgr.gc_pending)
+        self.assertEqual(len(self.async_timeouts), 1)
+        self.run_timeouts()
+        self.assertFalse(self.mgr.gc_pending)
+        self.mgr.attach_view(views[0])
+        self.mgr.detach_view(views[0])
+        self.assertEqual(len(self.async_timeouts), 1)
+
+
+class TestCollection(ColorSchemeTestCase):
+    def test_unused_files_within_cap_kept(self):
+        self.mgr.cs_refcounts = {'used.sublime-color-scheme': 1}
+        self.write_file('used.sublime-color-scheme', 100, 1000)
+        for i in range(4):
+            self.write_file(f'old{i}.sublime-color-scheme', 100, 2000 + i)
+        self.mgr.collect_color_schemes(cap=250)
+        self.assertEqual(self.cached_files(), [
+            'old2.sublime-color-scheme',
+            'old3.sublime-color-scheme',
+            'used.sublime-color-scheme',
+        ])
+        manifest = json.loads(
+            self.mgr.cache_path().joinpath(MANIFEST_FILE).read_text())
+        self.assertEqual(sorted(manifest), self.cached_files())
+
+    def test_clear_removes_unused_files(self):
+        view = StandInView(MONOKAI)
+        self.mgr.attach_view(view)
+        self.run_timeouts()
+        self.mgr.detach_view(view)
+        self.async_timeouts.clear()
+        self.assertEqual(self.mgr.last_written_cs, MONOKAI)
+        self.mgr.clear_color_schemes()
+        self.assertEqual(self.cached_files(), [])
+        self.assertEqual(self.mgr.load_manifest(), {})
+        self.assertIsNone(self.mgr.last_written_cs)
+        # The color scheme is written again once a view uses it
+        self.mgr.attach_view(view)
+        self.run_timeouts()
+        self.assertEqual(self.cached_files(), [cs_file_name(MONOKAI)])
+
+    def test_clear_keeps_used_files(self):
+        view = StandInView(MONOKAI)
+        self.mgr.attach_view(view)
+        self.run_timeouts()
+        self.write_file('old.sublime-color-scheme', 100, 1000)
+        self.mgr.clear_color_schemes()
+        self.assertEqual(self.cached_files(), [cs_file_name(MONOKAI)])
+        self.assertEqual(self.mgr.last_written_cs, MONOKAI)
@@ -0,0 +1,345 @@
+"""
+Tests of the incremental updates of `RainbowBracketsExecutor`, which
+must leave it in the state a full scan of the text would.
+
+Run them with the UnitTesting package. The executors drive a stand-in
+view, whose text is edited by `edit`.
+"""
+import random
+import re
+import unittest
+
+from typing import Any, Dict, List, Optional
+
+import sublime
+
+from ..plugin.engine   import compile_config
+from ..plugin.executor import RainbowBracketsExecutor
+from ..plugin.logger   import Logger
+from ..plugin.manager  import RainbowBracketsViewManager as _manager
+from ..plugin.memory   import executor_memory_estimate
+from ..plugin.memory   import executor_memory_usage
+
+
+def scheme_config(colors: int = 3) -> Dict[str, Any]:
+    config = {
+        'bracket_pairs': {'(': ')', '[': ']'},
+        'color.cycle': [f'#0000{i:02X}' for i in range(colors)],
+        'color.error': '#FF0000',
+        'ignored_scopes': ['comment', 'constant'],
+        'coloring': True,
+    }
+    compile_config(config, 'Scheme', False, {})
+    return config
+
+
+# The scopes of the stand-in view, a lexical approximation of Scheme
+SCOPES = re.compile(r'(;[^\n]*)|(#\\(?:[a-z]+|.))')
+
+
+class StandInPosition:
+    def __init__(self, pt: int):
+        self.pt = pt
+
+
+class StandInChange:
+    def __init__(self, a: int, b: int, text: str):
+        self.a = StandInPosition(a)
+        self.b = StandInPosition(b)
+        self.str = text
+
+
+class StandInView:
+    """
+    Implements the part of `sublime.View` used by the executor.
+    """
+    def __init__(self, text: str):
+        self.view_id = -id(self)
+        self.text = text
+        self.changes = 0
+        self.regions: Dict[str, List[sublime.Region]] = {}
+        self.selection: List[sublime.Region] = []
+
+    def size(self) -> int:
+        return len(self.text)
+
+    def substr(self, region: sublime.Region) -> str:
+        return self.text[region.begin():region.end()]
+
+    def match_selector(self, point: int, selector: str) -> bool:
+        for m in SCOPES.finditer(self.text):
+            if m.start() <= point < m.end():
+                scope = 'comment' if m.lastindex == 1 else 'constant'
+                return scope in selector.split('|')
+        return False
+
+    def change_count(self) -> int:
+        return self.changes
+
+    def file_name(self) -> Optional[str]:
+        return None
+
+    def is_valid(self) -> bool:
+        return True
+
+    def sel(self):
+        return self.selection
+
+    def add_regions(self, key: str, regions: List[sublime.Region], **kwargs):
+        self.regions[key] = regions
+
+    def erase_regions(self, key: str):
+        self.regions.pop(key, None)
+
+
+def scanned(text: str, config: Dict[str, Any]) -> RainbowBracketsExecutor:
+    executor = RainbowBracketsExecutor(StandInView(text), 'Scheme', config)
+    executor.check_bracket_regions()
+    return executor
+
+
+def edit(executor: RainbowBracketsExecutor, *changes: StandInChange):
+    """
+    Apply `changes` to the text of the view, one after the other, and
+    pass them on to the executor.
+    """
+    view = executor.view
+    for change in changes:
+        a, b = change.a.pt, change.b.pt
+        view.text = view.text[:a] + change.str + view.text[b:]
+    view.changes += 1
+    executor.update_bracket_regions(changes)
+
+
+def tree_offsets(trees, head_names: List[str]) -> List[Any]:
+    return [
+        (node.oa, node.ob, node.ca, node.cb, head_names[node.head],
+         tree_offsets(node.contain, head_names))
+        for node in trees
+    ]
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def assertScanned(self, executor: RainbowBracketsExecutor):
+        """
+        Assert that the brackets of `executor` are the ones of a full
+        scan of the text of its view.
+        """
+        expected = scanned(executor.view.text, executor.config)
+        self.assertEqual(executor.text, expected.text)
+        self.assertEqual(
+            tree_offsets(executor.bracket_regions_trees, executor.head_names),
+            tree_offsets(expected.bracket_regions_trees, expected.head_names))
+        self.assertEqual(
+            tree_offsets(executor.unclosed_trees, executor.head_names),
+            tree_offsets(expected.unclosed_trees, expected.head_names))
+        self.assertEqual(
+            [list(offsets) for offsets in executor.bracket_regions_lists],
+            [list(offsets) for offsets in expected.bracket_regions_lists])
+        self.assertEqual(
+            list(executor.err_bracket_regions),
+            list(expected.err_bracket_regions))
+
+
+class TestRekey(ExecutorTestCase):
+    def test_unclosed_brackets_kept(self):
+        executor = scanned('(define (f x) [g x])\n(let ((y 1)) y', scheme_config(3))
+        painted = sum(map(len, executor.view.regions.values()))
+        executor.rekey(scheme_config(4))
+        self.assertScanned(executor)
+        self.assertEqual(sum(map(len, executor.view.regions.values())), painted)
+
+    def test_rekey_then_edit(self):
+        executor = scanned('(())(a())', scheme_config(3))
+        executor.rekey(scheme_config(2))
+        self.assertScanned(executor)
+        edit(executor, StandInChange(6, 6, 'x'))
+        self.assertScanned(executor)
+        executor.rekey(scheme_config(3))
+        self.assertScanned(executor)
+
+    def test_edit_in_unclosed_bracket(self):
+        executor = scanned('(a (b) [c (d)', scheme_config(2))
+        edit(executor, StandInChange(1, 1, 'xy'))
+        self.assertScanned(executor)
+        executor.rekey(scheme_config(3))
+        self.assertScanned(executor)
+
+
+class TestShiftOffsets(ExecutorTestCase):
+    def test_multiple_cursors(self):
+        line = '(define (f x) [g x]) ; (\n'
+        executor = scanned(line * 50, scheme_config())
+        trees = executor.bracket_regions_trees
+        # A cursor after `define` on each line, then a deletion
+        edit(executor, *(
+            StandInChange(i * (len(line) + 1) + 7, i * (len(line) + 1) + 7, 's')
+            for i in range(50)
+        ))
+        self.assertIs(executor.bracket_regions_trees, trees)
+        self.assertScanned(executor)
+        edit(executor, *(
+            StandInChange(i * (len(line) - 1) + 1, i * (len(line) - 1) + 3, '')
+            for i in range(50)
+        ))
+        self.assertIs(executor.bracket_regions_trees, trees)
+        self.assertScanned(executor)
+
+    def test_bracket_enters_ignored_scope(self):
+        executor = scanned('(list #\\a(x))', scheme_config())
+        edit(executor, StandInChange(8, 9, ''))
+        self.assertEqual(executor.view.text, '(list #\\(x))')
+        self.assertScanned(executor)
+        self.assertEqual(len(executor.err_bracket_regions), 2)
+
+    def test_bracket_leaves_ignored_scope(self):
+        executor = scanned('(list #\\(x))', scheme_config())
+        edit(executor, StandInChange(8, 8, 'a'))
+        self.assertScanned(executor)
+        self.assertEqual(len(executor.err_bracket_regions), 0)
+
+    def test_scope_change_after_ignored_bracket(self):
+        # The `(` stays ignored, while the `;` turns the `)` after it
+        # into a comment
+        executor = scanned('(list #\\; #\\( x)', scheme_config())
+        edit(executor, StandInChange(7, 7, 'e'))
+        self.assertEqual(executor.view.text, '(list #e\\; #\\( x)')
+        self.assertScanned(executor)
+        self.assertEqual(executor.bracket_regions_trees, [])
+
+    def test_random_edits(self):
+        rng = random.Random(28)
+        pieces = ['(', ')', '[', ']', ' ', 'x', 'let', '\n', '; c', '#\\', '#\\;']
+        texts = ['a', 'b', ' ', 'xy', '(', ')', '']
+        for _ in range(200):
+            text = ''.join(rng.choice(pieces) for _ in range(60))
+            executor = scanned(text, scheme_config(rng.randint(1, 4)))
+            for _ in range(5):
+                changes = []
+                size = len(executor.view.text)
+                points = sorted(rng.sample(range(size + 1), rng.randint(1, 4)))
+                shift = 0
+                for point in points:
+                    end = min(point + rng.randint(0, 2), size)
+                    if changes and point < changes[-1][1]:
+                        continue
+                    changes.append((point, end, rng.choice(texts)))
+                edit(executor, *(
+                    StandInChange(a + shift, b + shift, inserted)
+                    for a, b, inserted in self.sequential(changes)
+                ))
+                self.assertScanned(executor)
+
+    @staticmethod
+    def sequential(changes):
+        """
+        Turn edits of the same text into edits made one after another.
+        """
+        shift = 0
+        for a, b, inserted in changes:
+            yield a + shift, b + shift, inserted
+            shift += len(inserted) - (b - a)
+
+
+class TestActivePairs(ExecutorTestCase):
+    def active_pairs(self, text: str, *points: int):
+        config = dict(scheme_config(), **{'color.active': '#FFFFFF'})
+        compile_config(config, 'Scheme', False, {})
+        executor = scanned(text, config)
+        executor.view.selection = [sublime.Region(pt) for pt in points]
+        executor.update_active_pairs()
+        return executor.active_pairs
+
+    def test_innermost_pairs(self):
+        self.assertEqual(
+            self.active_pairs('(a (b) [c])', 5, 8, 11),
+            [(0, 1, 10, 11), (3, 4, 5, 6), (7, 8, 9, 10)])
+
+    def test_pairs_in_unclosed_bracket(self):
+        text = '(a (b)) (define (f x) [g x'
+        self.assertEqual(
+            self.active_pairs(text, 4, 18, 24, len(text)),
+            [(3, 4, 5, 6), (16, 17, 20, 21)])
+
+
+class TestHeads(ExecutorTestCase):
+    def test_reparse_resets_heads(self):
+        executor = scanned('(name0)', scheme_config())
+        for i in range(1, 500):
+            executor.view.text = f'(name{i})'
+            executor.check_bracket_regions()
+        self.assertEqual(executor.head_names, ['', 'name499'])
+
+    def test_typed_heads_compacted(self):
+        executor = scanned('(d x) (let y)', scheme_config())
+        trees = executor.bracket_regions_trees
+        for i in range(500):
+            edit(executor, StandInChange(2 + i, 2 + i, 'e'))
+        self.assertIs(executor.bracket_regions_trees, trees)
+        self.assertScanned(executor)
+        self.assertLessEqual(len(executor.head_names), 2 * 3 + 64 + 1)
+        self.assertIn('let', executor.head_names)
+
+    def test_heads_stop_at_brackets(self):
+        config = scheme_config()
+        config['bracket_pairs'] = {'(': ')', '<': '>'}
+        compile_config(config, 'Scheme', False, {})
+        executor = scanned('(a<b> x)', config)
+        edit(executor, StandInChange(4, 4, 'c'))
+        self.assertScanned(executor)
+        self.assertEqual(
+            tree_offsets(executor.bracket_regions_trees, executor.head_names),
+            [(0, 1, 8, 9, 'a', [(2, 3, 5, 6, 'bc', [])])])
+
+    def test_heads_not_collected(self):
+        executor = scanned('(define (f x) x)', scheme_config())
+        executor.collect_heads = False
+        executor.check_bracket_regions()
+        self.assertEqual(executor.head_names, [''])
+        self.assertEqual(
+            [node.head for node in executor.bracket_regions_trees], [0])
+
+
+class TestMemory(ExecutorTestCase):
+    def setUp(self):
+        self.text = '(define (f x) [let ((y (g x))) (h y)])\n' * 500 + '(a (b) [c'
+
+    def scanned(self, coloring: bool):
+        config = dict(scheme_config(), coloring=coloring, selector='')
+        return scanned(self.text, config)
+
+    def test_pair_count(self):
+        for coloring in (True, False):
+            executor = self.scanned(coloring)
+            self.assertEqual(executor.pair_count, 500 * 7 + 1)
+
+    def test_estimate(self):
+        for coloring in (True, False):
+            executor = self.scanned(coloring)
+            estimate = executor_memory_estimate(executor)
+            total = executor_memory_usage(executor).total
+            self.assertAlmostEqual(estimate / total, 1, delta=0.1)
+
+    def test_ceiling_warned_once(self):
+        executor = self.scanned(True)
+        estimate = executor_memory_estimate(executor)
+        warnings = []
+        saved = (
+            _manager.view_executors, _manager.memory_ceiling,
+            _manager.memory_exceeded, Logger.warn)
+        _manager.view_executors = {executor.view.view_id: executor}
+        _manager.memory_exceeded = False
+        Logger.warn = warnings.append
+        try:
+            _manager.memory_ceiling = estimate - 1
+            _manager.check_memory_ceiling()
+            _manager.check_memory_ceiling()
+            self.assertEqual(len(warnings), 1)
+            _manager.memory_ceiling = estimate + 1
+            _manager.check_memory_ceiling()
+            _manager.memory_ceiling = estimate - 1
+            _manager.check_memory_ceiling()
+            self.assertEqual(len(warnings), 2)
+        finally:
+            (_manager.view_executors, _manager.memory_ceiling,
+             _manager.memory_exceeded, Logger.warn) = saved
@@ -0,0 +1,171 @@
+"""
+Tests of the command line linter, `scripts/rb_lint.py`.
+
+Run them with the UnitTesting package. The linter is loaded from its
+file, and lints the files of a temporary directory in this process.
+"""
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from typing import Any, Dict, List, Tuple
+
+
+def _load_linter():
+    path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'scripts', 'rb_lint.py')
+    spec = importlib.util.spec_from_file_location('rb_lint', path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+rb_lint = _load_linter()
+
+
+SETTINGS = '''{
+    // The packaged settings have comments
+    "default_config": {
+        "bracket_pairs": {"(": ")", "[": "]", "{": "}"},
+        "color.cycle": ["#FF0000", "#00FF00"],
+        "ignored_scopes": ["comment", "string"], /* and trailing commas */
+    },
+    "syntax_specific": {
+        "Scheme": {
+            "bracket_pairs": {"(": ")", "[": "]"},
+            "ignored_scopes": ["comment", "string", "constant"],
+            "extensions": [".ss"],
+        },
+        "JSON": {
+            "description": "// not a comment, /* nor */ this,]",
+            "extensions": [".json"],
+        },
+    },
+}
+'''
+
+
+class LinterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = self.write('RainbowBrackets.sublime-settings', SETTINGS)
+        rb_lint._matchers.clear()
+        rb_lint._syntaxes_by_ext.clear()
+
+    def tearDown(self):
+        rb_lint._matchers.clear()
+        rb_lint._syntaxes_by_ext.clear()
+        self.directory.cleanup()
+
+    def write(self, name: str, text: str, encoding='utf-8') -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding=encoding) as file:
+            file.write(text)
+        return path
+
+    def lint(self, name: str, text: str) -> List[Tuple[Any, ...]]:
+        rb_lint.init_worker(self.settings)
+        path, mismatches, error = rb_lint.lint_file(self.write(name, text))
+        self.assertIsNone(error)
+        return [
+            (m['line'], m['column'], m['bracket'], m['kind'])
+            for m in mismatches
+        ]
+
+    def main(self, *args: str) -> Tuple[int, List[Dict[str, Any]], str]:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), \
+             contextlib.redirect_stderr(stderr):
+            status = rb_lint.main([
+                '--settings', self.settings, '--jobs', '1', *args])
+        mismatches = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return status, mismatches, stderr.getvalue()
+
+
+class TestSettings(LinterTestCase):
+    def test_comments_and_trailing_commas(self):
+        settings = rb_lint.load_settings(self.settings)
+        self.assertEqual(
+            settings['default_config']['ignored_scopes'],
+            ['comment', 'string'])
+        self.assertEqual(
+            settings['syntax_specific']['JSON']['description'],
+            '// not a comment, /* nor */ this,]')
+
+    def test_configs(self):
+        configs, syntaxes_by_ext = rb_lint.load_configs(
+            rb_lint.load_settings(self.settings))
+        self.assertEqual(syntaxes_by_ext, {'.ss': 'Scheme', '.json': 'JSON'})
+        self.assertEqual(configs['Scheme']['tokens'], ['(', ')', '[', ']'])
+        # Inherited from the default config
+        self.assertEqual(configs['JSON']['tokens'], ['(', ')', '[', ']', '{', '}'])
+        self.assertTrue(configs['JSON']['enabled'])
+
+
+class TestLexer(LinterTestCase):
+    def test_ignored_groups(self):
+        lexer, ignored_groups = rb_lint.compile_lexer(
+            'Scheme', ['comment - comment.block', 'constant'])
+        self.assertEqual(ignored_groups, [False, True, False, True])
+        self.assertEqual(
+            lexer.match('"a ; b" ; c').group(), '"a ; b"')
+
+    def test_nothing_ignored(self):
+        self.assertEqual(
+            rb_lint.compile_lexer('Scheme', ['meta.quoted']), (None, []))
+
+    def test_blanked_text(self):
+        lexer, ignored_groups = rb_lint.compile_lexer(
+            'Scheme', ['comment', 'constant'])
+        configs, _ = rb_lint.load_configs(rb_lint.load_settings(self.settings))
+        matcher = rb_lint.FileBracketMatcher(
+            configs['Scheme'], lexer, ignored_groups)
+        matcher.source = '(a #\\( "(" ; (\n #| ( \n |# b)'
+        self.assertEqual(
+            matcher.read_text(), '(a     "("    \n      \n    b)')
+
+
+class TestLintFile(LinterTestCase):
+    def test_mismatches(self):
+        self.assertEqual(
+            self.lint('a.ss', '(define (f x)\n  [g x)\n(h "(" ; (\n'),
+            [(1, 1, '(', 'unclosed'),
+             (2, 3, '[', 'unclosed'),
+             (2, 7, ')', 'unmatched'),
+             (3, 1, '(', 'unclosed')])
+
+    def test_ignored_brackets(self):
+        self.assertEqual(self.lint('a.ss', '(a #\\) ; )\n "]" b)'), [])
+        self.assertEqual(self.lint('a.json', '{"a": "]"} // }'), [])
+
+
+class TestMain(LinterTestCase):
+    def test_status(self):
+        self.write('clean.ss', '(a [b] c)')
+        status, mismatches, _ = self.main(self.directory.name)
+        self.assertEqual((status, mismatches), (0, []))
+
+        self.write('other.txt', '(')
+        self.write('mismatched.json', '{"a": [1}')
+        status, mismatches, _ = self.main(self.directory.name)
+        self.assertEqual(status, 1)
+        self.assertEqual(
+            [(os.path.basename(m['path']), m['bracket']) for m in mismatches],
+            [('mismatched.json', '{'),
+             ('mismatched.json', '['),
+             ('mismatched.json', '}')])
+
+    def test_unreadable_files(self):
+        self.write('clean.ss', '(a [b] c)')
+        unreadable = self.write('unreadable.ss', '(é)', encoding='latin-1')
+        status, mismatches, errors = self.main(self.directory.name)
+        self.assertEqual((status, mismatches), (2, []))
+        self.assertTrue(errors.startswith(f'{unreadable}: '))
+        status, _, _ = self.main('--skip-unreadable', self.directory.name)
+        self.assertEqual(status, 0)